@@ -5,16 +5,35 @@ CREATE TABLE IF NOT EXISTS incidents (
     status TEXT,
     first_seen TIMESTAMP,
     last_seen TIMESTAMP,
-    rca_text TEXT
+    rca_text TEXT,
+    -- Hash of the model and incident data rca_text was generated from (llm-service cache)
+    rca_key TEXT
 );
 
+-- Range-partitioned by day on timestamp. anomaly-service (partitions.py)
+-- creates the upcoming partitions and drops the ones past retention; the
+-- default partition only catches rows outside the managed range.
 CREATE TABLE IF NOT EXISTS anomalies (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     incident_id INT,
     service_name TEXT,
     metric_name TEXT,
     severity TEXT,
     value DOUBLE PRECISION,
     baseline DOUBLE PRECISION,
-    timestamp TIMESTAMP
-);
\ No newline at end of file
+    timestamp TIMESTAMP NOT NULL,
+    -- Anomaly episodes: one row per episode, updated on escalation and on resolution
+    episode_id TEXT,
+    peak_value DOUBLE PRECISION,
+    ended_at TIMESTAMP,
+    duration_seconds DOUBLE PRECISION,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS anomalies_default PARTITION OF anomalies DEFAULT;
+
+-- The incident aggregator only ever scans recent unassigned anomalies
+CREATE INDEX IF NOT EXISTS anomalies_unassigned_idx ON anomalies (timestamp) WHERE incident_id IS NULL;
+CREATE INDEX IF NOT EXISTS anomalies_episode_id_idx ON anomalies (episode_id);
+-- llm-service summarizes the anomalies of one incident at a time
+CREATE INDEX IF NOT EXISTS anomalies_incident_id_idx ON anomalies (incident_id) WHERE incident_id IS NOT NULL;
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Detection loop benchmark for anomaly-service.
+
+Runs the production tick path (QueryResolver.fetch -> split_signals ->
+DetectionEngine.observe -> EpisodeTracker.update) back to back against
+bench/fake_prometheus.py at several series counts and reports ticks per
+second, fetch and detection latency and peak memory. Each case gets its
+own fake Prometheus and its own interpreter, so peak RSS is per case.
+
+Modes:
+  single          the aggregate QUERY series (the original p95 path)
+  series          SERIES_QUERY, one p95 series per service/uri
+  signals         combined SIGNALS query, quantiles computed by Prometheus
+  signals-client  combined SIGNALS query, quantiles computed from bucket rates
+
+  python bench/bench.py
+  python bench/bench.py --sizes 100,10000 --modes signals --json before.json
+  python bench/bench.py --baseline before.json --tolerance 0.2
+
+With --baseline the run exits 1 if any case got slower (ticks/s, detection
+p95) or bigger (peak RSS) than the baseline by more than the tolerance.
+Detector settings come from the same environment variables as main.py.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+import main  # noqa: E402
+from prom import PromClient, unit_scale  # noqa: E402
+from resolver import QueryResolver  # noqa: E402
+from signals import combined_query, split_signals  # noqa: E402
+
+FAKE_PROMETHEUS = os.path.join(SERVICE_DIR, "bench", "fake_prometheus.py")
+MODES = ("single", "series", "signals", "signals-client")
+# Compared against --baseline: (field, True if higher is better)
+REGRESSION_FIELDS = (("ticks_per_sec", True), ("detect_p95_ms", False), ("peak_rss_mb", False))
+
+
+def tick_path(mode: str):
+    """(engine names, query, scale, function splitting one result per engine) for a mode."""
+    if mode == "single":
+        return ["p95_latency"], main.QUERY, None, lambda samples: {"p95_latency": samples}
+    if mode == "series":
+        return ["p95_latency"], main.DEFAULT_SERIES_QUERY, None, lambda samples: {"p95_latency": samples}
+    metric = main.SIGNAL_METRIC
+    query = combined_query(main.signal_set(metric, main.SIGNALS, mode == "signals-client"))
+    return (main.SIGNALS, query, 1.0,
+            lambda samples: split_signals(samples, main.SIGNALS, unit_scale(metric)))
+
+
+async def measure_async(mode: str, series: int, prom_url: str, ticks: int, warmup: int) -> dict:
+    names, query, scale, split = tick_path(mode)
+    engines = {name: main.make_engine(name, capacity=series) for name in names}
+    trackers = {name: main.make_tracker(name) for name in names}
+    fetch, detect, total = [], [], []
+    samples = anomalies = writes = 0
+
+    async with PromClient(prom_url, main.PROM_MAX_CONCURRENCY, main.PROM_TIMEOUT) as prom:
+        resolver = QueryResolver(prom, query, name=mode, scale=scale)
+        started = time.perf_counter()
+        for i in range(warmup + ticks):
+            if i == warmup:
+                started = time.perf_counter()
+            t0 = time.perf_counter()
+            results = await resolver.fetch()
+            t1 = time.perf_counter()
+            detections = 0
+            for name, signal_samples in split(results).items():
+                found = engines[name].observe(signal_samples)
+                detections += len(found)
+                writes += len(trackers[name].update(engines[name], found)) if i >= warmup else 0
+            t2 = time.perf_counter()
+            if i >= warmup:
+                fetch.append(t1 - t0)
+                detect.append(t2 - t1)
+                total.append(t2 - t0)
+                samples += len(results)
+                anomalies += detections
+        elapsed = time.perf_counter() - started
+
+    def ms(values, q):
+        return round(float(np.percentile(values, q)) * 1000, 3)
+
+    return {
+        "mode": mode,
+        "series": series,
+        "ticks": ticks,
+        "samples_per_tick": samples // ticks,
+        "tracked_series": sum(len(e.windows) for e in engines.values()),
+        "ticks_per_sec": round(ticks / elapsed, 2),
+        "tick_p50_ms": ms(total, 50),
+        "tick_p95_ms": ms(total, 95),
+        "fetch_p50_ms": ms(fetch, 50),
+        "fetch_p95_ms": ms(fetch, 95),
+        "detect_p50_ms": ms(detect, 50),
+        "detect_p95_ms": ms(detect, 95),
+        "anomalies": anomalies,
+        "episode_writes": writes,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def measure(mode: str, series: int, prom_url: str, ticks: int, warmup: int) -> dict:
+    return asyncio.run(measure_async(mode, series, prom_url, ticks, warmup))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/-/healthy", timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"fake Prometheus did not come up on :{port}")
+            time.sleep(0.1)
+
+
+def run_case(mode: str, series: int, args: argparse.Namespace) -> dict:
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, FAKE_PROMETHEUS, "--port", str(port), "--series", str(series),
+        "--spike-rate", str(args.spike_rate), "--nan-rate", str(args.nan_rate),
+        "--delay", str(args.delay), "--slow-rate", str(args.slow_rate), "--seed", str(args.seed),
+    ], stdout=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        # A fresh interpreter per case so peak RSS is not inherited from earlier, larger cases
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            return pool.submit(measure, mode, series, f"http://127.0.0.1:{port}/api/v1/query",
+                               args.ticks, args.warmup).result()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def print_table(results: list[dict]):
+    columns = ["mode", "series", "samples_per_tick", "ticks_per_sec", "tick_p50_ms", "fetch_p50_ms",
+               "detect_p50_ms", "detect_p95_ms", "peak_rss_mb", "anomalies"]
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).rjust(w) for c, w in zip(columns, widths)))
+
+
+def regressions(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    before = {(r["mode"], r["series"]): r for r in baseline}
+    found = []
+    for r in results:
+        base = before.get((r["mode"], r["series"]))
+        if base is None:
+            continue
+        for field, higher_is_better in REGRESSION_FIELDS:
+            old, new = base[field], r[field]
+            worse = new < old * (1 - tolerance) if higher_is_better else new > old * (1 + tolerance)
+            if worse:
+                found.append(f"{r['mode']} @ {r['series']} series: {field} {old} -> {new}")
+    return found
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,100,10000,100000", help="comma-separated series counts")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"comma-separated, from {', '.join(MODES)}")
+    parser.add_argument("--ticks", type=int, default=30, help="measured ticks per case")
+    parser.add_argument("--warmup", type=int, default=main.WINDOW_SIZE,
+                        help="unmeasured ticks first, to fill the windows (default WINDOW_SIZE)")
+    parser.add_argument("--spike-rate", type=float, default=0.001)
+    parser.add_argument("--nan-rate", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.0, help="fake Prometheus response delay (s)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of slow (+1s) responses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    modes = [m for m in args.modes.split(",") if m]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    results = []
+    for mode in modes:
+        # The aggregate query returns one series however many the fake serves
+        for series in [1] if mode == "single" else sizes:
+            print(f"[bench] {mode} @ {series} series...", file=sys.stderr, flush=True)
+            results.append(run_case(mode, series, args))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
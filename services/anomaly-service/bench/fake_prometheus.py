@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Synthetic stand-in for the Prometheus HTTP API.
+
+Serves /api/v1/query, /api/v1/query_range, /api/v1/series and
+/api/v1/label/<name>/values from a generator of N latency series (one per
+service_name/uri pair), so anomaly-service can be exercised and benchmarked
+without the docker-compose stack:
+
+  python bench/fake_prometheus.py --series 10000 --spike-rate 0.001 --nan-rate 0.01
+  PROM_URL=http://localhost:9099/api/v1/query DETECTION_MODE=multi python main.py
+
+It does not evaluate PromQL. It reads just enough of the query to shape the
+answer the way Prometheus would:
+
+  - the `signal` tags of a combined signals query (signals.py): one result
+    per signal, `latency_buckets` as per-`le` bucket rates
+  - the last `by (...)` clause: series are averaged down to those labels,
+    so `by (le)` gives the single aggregate series
+  - a `service_name=~"..."` matcher (shard filter): only matching services
+  - `milliseconds` in the metric name: latency values and `le` bounds in ms
+
+Instant queries without a `time` parameter each advance their own clock by
+one step, so back-to-back ticks always see fresh samples. Values at a given
+step are deterministic for a given seed, with spikes and NaN gaps drawn per
+series and step.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import defaultdict
+
+import numpy as np
+from aiohttp import web
+
+LABELS = ("service_name", "uri")
+# Upper bounds in seconds, as in the Micrometer/OTel default SLO buckets
+BUCKET_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+SIGNAL_TAG = re.compile(r'"signal", "([\w.]+)"')
+GROUP_BY = re.compile(r"by \(([^)]*)\)")
+SERVICE_MATCHER = re.compile(r'service_name=~"((?:[^"\\]|\\.)*)"')
+LATENCY_SIGNAL = re.compile(r"p(\d+(?:\.\d+)?)_latency")
+
+
+def format_value(value: float) -> str:
+    return "NaN" if value != value else repr(value)
+
+
+class SyntheticMetrics:
+    """Deterministic latency, error and traffic series for `series` service/uri pairs."""
+
+    def __init__(self, series: int = 100, services: int | None = None, step: float = 15.0,
+                 spike_rate: float = 0.001, spike_factor: float = 8.0, nan_rate: float = 0.0,
+                 seed: int = 0):
+        self.series = series
+        self.services = services or max(1, series // 100)
+        self.step = step
+        self.spike_rate = spike_rate
+        self.spike_factor = spike_factor
+        self.nan_rate = nan_rate
+        self.seed = seed
+
+        index = np.arange(series)
+        self.service_index = index % self.services
+        self.service_names = [f"svc-{i:04d}" for i in range(self.services)]
+        self.uris = [f"/api/{i // self.services}" for i in index]
+        rng = np.random.default_rng(seed)
+        self.base_latency = rng.uniform(0.02, 0.3, series)
+        self.base_rate = rng.uniform(1.0, 50.0, series)
+
+    def _draw(self, t: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(noise, spike mask, gap mask) for step `t`."""
+        rng = np.random.default_rng((self.seed, t))
+        noise = rng.standard_normal(self.series)
+        spikes = rng.random(self.series) < self.spike_rate
+        gaps = rng.random(self.series) < self.nan_rate
+        return noise, spikes, gaps
+
+    def latency(self, t: int, quantile: float = 0.95) -> np.ndarray:
+        """Latency quantile in seconds per series."""
+        noise, spikes, gaps = self._draw(t)
+        value = self.base_latency * (1 + 0.05 * noise) * (quantile / 0.95)
+        value = np.where(spikes, value * self.spike_factor, value)
+        return np.where(gaps, np.nan, value)
+
+    def request_rate(self, t: int) -> np.ndarray:
+        noise, spikes, gaps = self._draw(t)
+        value = self.base_rate * (1 + 0.05 * noise)
+        return np.where(gaps, np.nan, value)
+
+    def error_ratio(self, t: int) -> np.ndarray:
+        noise, spikes, gaps = self._draw(t)
+        value = np.clip(0.01 * (1 + 0.3 * noise), 0, 1)
+        value = np.where(spikes, 0.5, value)
+        return np.where(gaps, np.nan, value)
+
+    def buckets(self, t: int) -> np.ndarray:
+        """Cumulative bucket rates (series x bounds + Inf) of an exponential latency distribution."""
+        rate = self.request_rate(t)
+        # Mean chosen so the 95th percentile lands on latency(t)
+        mean = self.latency(t) / np.log(20)
+        bounds = np.array(BUCKET_BOUNDS)
+        cumulative = rate[:, None] * (1 - np.exp(-bounds[None, :] / mean[:, None]))
+        return np.concatenate([cumulative, rate[:, None]], axis=1)
+
+    def groups(self, labels: tuple[str, ...], services: set[str] | None) -> tuple[list[dict], np.ndarray, np.ndarray]:
+        """Output label sets for a grouping, the group of every series and which series are selected."""
+        selected = np.ones(self.series, dtype=bool)
+        if services is not None:
+            selected = np.isin(self.service_index,
+                               [i for i, name in enumerate(self.service_names) if name in services])
+        if "uri" in labels:
+            keys = [{"service_name": self.service_names[s], "uri": u}
+                    for s, u in zip(self.service_index, self.uris)]
+            return keys, np.arange(self.series), selected
+        if "service_name" in labels:
+            return [{"service_name": name} for name in self.service_names], self.service_index, selected
+        return [{}], np.zeros(self.series, dtype=np.int64), selected
+
+
+def aggregate(values: np.ndarray, group: np.ndarray, selected: np.ndarray, groups: int) -> np.ndarray:
+    """Mean per group over the selected series."""
+    if groups == len(values):
+        return values
+    sums = np.zeros((groups, *values.shape[1:]))
+    counts = np.bincount(group[selected], minlength=groups).astype(float)
+    np.add.at(sums, group[selected], values[selected])
+    with np.errstate(invalid="ignore"):
+        return sums / (counts.reshape(-1, *([1] * (values.ndim - 1))))
+
+
+class FakePrometheus:
+    def __init__(self, metrics: SyntheticMetrics, delay: float = 0.0, slow_rate: float = 0.0,
+                 slow_delay: float = 1.0):
+        self.metrics = metrics
+        self.delay = delay
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.clocks: dict[str, int] = defaultdict(int)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/api/v1/query", self.query)
+        app.router.add_route("*", "/api/v1/query_range", self.query_range)
+        app.router.add_route("*", "/api/v1/series", self.series)
+        app.router.add_get("/api/v1/label/{name}/values", self.label_values)
+        app.router.add_get("/-/healthy", self.healthy)
+        return app
+
+    async def healthy(self, request: web.Request) -> web.Response:
+        return web.Response(text="Prometheus is Healthy.\n")
+
+    async def _params(self, request: web.Request) -> dict:
+        pause = self.delay + (self.slow_delay if random.random() < self.slow_rate else 0.0)
+        if pause:
+            await asyncio.sleep(pause)
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        return params
+
+    def _results(self, query: str, t: int) -> list[tuple[dict, float]]:
+        """(labels, value) rows the query would return at step `t`."""
+        metrics = self.metrics
+        by = GROUP_BY.findall(query)
+        labels = tuple(l.strip() for l in by[-1].split(",")) if by else LABELS
+        matcher = SERVICE_MATCHER.search(query)
+        services = None
+        if matcher:
+            pattern = re.compile(matcher.group(1).replace("\\\\", "\\"))
+            services = {name for name in metrics.service_names if pattern.fullmatch(name)}
+        keys, group, selected = metrics.groups(labels, services)
+        # Groups left empty by the shard matcher do not exist in Prometheus
+        present = np.bincount(group[selected], minlength=len(keys)) > 0
+        in_ms = "milliseconds" in query
+
+        rows = []
+        for signal in SIGNAL_TAG.findall(query) or [None]:
+            tag = {"signal": signal} if signal else {}
+            if signal == "latency_buckets":
+                cumulative = aggregate(metrics.buckets(t), group, selected, len(keys))
+                bounds = [b * 1000 if in_ms else b for b in BUCKET_BOUNDS]
+                les = [format(b, "g") for b in bounds] + ["+Inf"]
+                for key, counts, exists in zip(keys, cumulative, present):
+                    if exists and not np.isnan(counts[-1]):
+                        rows.extend(({**key, **tag, "le": le}, c) for le, c in zip(les, counts.tolist()))
+                continue
+            if signal == "error_ratio":
+                values = metrics.error_ratio(t)
+            elif signal == "request_rate":
+                values = metrics.request_rate(t)
+            else:
+                match = LATENCY_SIGNAL.fullmatch(signal or "")
+                values = metrics.latency(t, float(match.group(1)) / 100 if match else 0.95)
+                # Signal queries convert to seconds in PromQL; plain ones return the metric's unit
+                if in_ms and signal is None:
+                    values = values * 1000
+            values = aggregate(values, group, selected, len(keys))
+            rows.extend(({**key, **tag}, v) for key, v, exists in zip(keys, values.tolist(), present) if exists)
+        return rows
+
+    def _step(self, query: str, params: dict) -> tuple[int, float]:
+        if "time" in params:
+            at = float(params["time"])
+            return int(at // self.metrics.step), at
+        self.clocks[query] += 1
+        return self.clocks[query], time.time()
+
+    async def query(self, request: web.Request) -> web.Response:
+        params = await self._params(request)
+        query = params.get("query", "")
+        t, at = self._step(query, params)
+        result = ",".join(
+            f'{{"metric":{json.dumps(key)},"value":[{at},"{format_value(v)}"]}}'
+            for key, v in self._results(query, t)
+        )
+        body = f'{{"status":"success","data":{{"resultType":"vector","result":[{result}]}}}}'
+        return web.Response(text=body, content_type="application/json")
+
+    async def query_range(self, request: web.Request) -> web.Response:
+        params = await self._params(request)
+        query = params.get("query", "")
+        start, end, step = float(params["start"]), float(params["end"]), float(params["step"])
+        series: dict[str, list] = {}
+        at = start
+        while at <= end:
+            for key, v in self._results(query, int(at // self.metrics.step)):
+                if v == v:
+                    series.setdefault(json.dumps(key), []).append(f'[{at},"{format_value(v)}"]')
+            at += step
+        result = ",".join(f'{{"metric":{key},"values":[{",".join(values)}]}}' for key, values in series.items())
+        body = f'{{"status":"success","data":{{"resultType":"matrix","result":[{result}]}}}}'
+        return web.Response(text=body, content_type="application/json")
+
+    async def series(self, request: web.Request) -> web.Response:
+        await self._params(request)
+        metrics = self.metrics
+        data = [{"__name__": "http_server_requests_milliseconds_count",
+                 "service_name": metrics.service_names[s], "uri": u}
+                for s, u in zip(metrics.service_index, metrics.uris)]
+        return web.json_response({"status": "success", "data": data})
+
+    async def label_values(self, request: web.Request) -> web.Response:
+        await self._params(request)
+        name = request.match_info["name"]
+        values = {"service_name": self.metrics.service_names, "uri": sorted(set(self.metrics.uris)),
+                  "__name__": ["http_server_requests_milliseconds_bucket",
+                               "http_server_requests_milliseconds_count"]}.get(name, [])
+        return web.json_response({"status": "success", "data": list(values)})
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--series", type=int, default=100, help="service/uri pairs to generate")
+    parser.add_argument("--services", type=int, help="distinct service_name values (default series/100)")
+    parser.add_argument("--step", type=float, default=15.0, help="seconds per sample for timed queries")
+    parser.add_argument("--spike-rate", type=float, default=0.001, help="chance of a spike per series and step")
+    parser.add_argument("--spike-factor", type=float, default=8.0)
+    parser.add_argument("--nan-rate", type=float, default=0.0, help="chance of a NaN sample per series and step")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of responses delayed further")
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="extra seconds for slow responses")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def serve(args: argparse.Namespace):
+    metrics = SyntheticMetrics(args.series, args.services, args.step, args.spike_rate,
+                               args.spike_factor, args.nan_rate, args.seed)
+    server = FakePrometheus(metrics, args.delay, args.slow_rate, args.slow_delay)
+    print(f"[fake-prometheus] {args.series} series on :{args.port}", flush=True)
+    web.run_app(server.app(), port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    serve(build_parser().parse_args())
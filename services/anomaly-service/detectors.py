@@ -0,0 +1,451 @@
+"""
+Incremental anomaly detectors.
+
+Every detector keeps per-row state next to a SeriesWindows ring buffer and
+is updated with only the newest sample (and the one that just fell out of
+the window), so a tick costs O(1) or O(log w) per series instead of
+rebuilding and rescanning the whole window.
+
+Scores are computed against the state *before* the new sample is folded in,
+which makes the baseline the statistic of the preceding window.
+"""
+
+import warnings
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from series import SeriesKey, SeriesWindows
+
+# Scale factor that makes the MAD a consistent estimator of the std dev
+MAD_SCALE = 1.4826
+# A variance this small relative to the squared level is rounding residue from the
+# incremental updates (e.g. after varied samples slid out of a now-flat window), not spread
+FLAT_VARIANCE = 1e-12
+
+
+class Detector:
+    """Base class: per-row incremental state addressed by SeriesWindows rows."""
+
+    name = ""
+
+    def __init__(self, window_size: int, capacity: int):
+        self.window_size = window_size
+        self.capacity = capacity
+
+    def resize(self, capacity: int):
+        """Grow per-row state to match a grown SeriesWindows buffer."""
+        self.capacity = capacity
+
+    def reset(self, rows: np.ndarray):
+        """Forget state for rows that were just (re)assigned to a new series."""
+
+    def update(self, rows: np.ndarray, values: np.ndarray,
+               evicted: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Score `values` against current state, then fold them in.
+
+        `evicted` holds the samples that left each row's window (NaN while the
+        window is still filling). Returns (scores, baselines).
+        """
+        raise NotImplementedError
+
+    def export(self, rows: np.ndarray) -> dict[str, np.ndarray]:
+        """State for `rows` that cannot be rebuilt from the window buffer."""
+        return {}
+
+    def restore(self, rows: np.ndarray, windows: SeriesWindows, state: dict[str, np.ndarray]):
+        """Rebuild state for `rows` after they were loaded into `windows` from a snapshot."""
+
+    def score_history(self, history: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized equivalent of calling update() once per column.
+
+        `history` is (series x samples) with each row's samples packed to the
+        left and NaN padding on the right. Returns (scores, baselines) with the
+        same shape, matching what the incremental path would have produced.
+        """
+        raise NotImplementedError
+
+
+def _std(var: np.ndarray, level: np.ndarray) -> np.ndarray:
+    """Std dev for scoring: 1.0 where the data is flat, so scores stay plain differences."""
+    std = np.sqrt(np.maximum(var, 0.0))
+    std[~(var > FLAT_VARIANCE * np.maximum(np.square(level), 1.0))] = 1.0
+    return std
+
+
+def _grow(arr: np.ndarray, capacity: int) -> np.ndarray:
+    out = np.zeros(capacity, dtype=arr.dtype)
+    out[:len(arr)] = arr
+    return out
+
+
+class RollingZScore(Detector):
+    """Rolling-window mean/variance via Welford's add/remove update."""
+
+    name = "zscore"
+
+    def __init__(self, window_size: int, capacity: int):
+        super().__init__(window_size, capacity)
+        self.n = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros(capacity)
+        self.m2 = np.zeros(capacity)
+
+    def resize(self, capacity: int):
+        super().resize(capacity)
+        self.n = _grow(self.n, capacity)
+        self.mean = _grow(self.mean, capacity)
+        self.m2 = _grow(self.m2, capacity)
+
+    def reset(self, rows: np.ndarray):
+        self.n[rows] = 0
+        self.mean[rows] = 0.0
+        self.m2[rows] = 0.0
+
+    def restore(self, rows, windows, state):
+        block = windows.values[rows]
+        n = windows.counts[rows]
+        mean = np.nansum(block, axis=1) / np.maximum(n, 1)
+        self.n[rows] = n
+        self.mean[rows] = mean
+        self.m2[rows] = np.nansum((block - mean[:, None]) ** 2, axis=1)
+
+    def update(self, rows, values, evicted):
+        n = self.n[rows]
+        mean = self.mean[rows]
+        m2 = self.m2[rows]
+
+        std = _std(m2 / np.maximum(n, 1), mean)
+        scores = (values - mean) / std
+        baselines = np.where(n > 0, mean, values)
+
+        # Window still filling: plain Welford add
+        full = ~np.isnan(evicted)
+        grow_n = n + 1
+        delta = values - mean
+        add_mean = mean + delta / grow_n
+        add_m2 = m2 + delta * (values - add_mean)
+
+        # Window full: replace the evicted sample in one step
+        old = np.where(full, evicted, 0.0)
+        slide_mean = mean + (values - old) / np.maximum(n, 1)
+        slide_m2 = m2 + (values - old) * (values - slide_mean + old - mean)
+
+        self.n[rows] = np.where(full, n, grow_n)
+        self.mean[rows] = np.where(full, slide_mean, add_mean)
+        self.m2[rows] = np.maximum(np.where(full, slide_m2, add_m2), 0.0)
+        return scores, baselines
+
+    def score_history(self, history):
+        # Center each row first so the cumulative sums do not lose precision
+        center = np.nanmean(history, axis=1, keepdims=True)
+        x = np.nan_to_num(history - center)
+        zeros = np.zeros((len(x), 1))
+        s1 = np.concatenate([zeros, np.cumsum(x, axis=1)], axis=1)
+        s2 = np.concatenate([zeros, np.cumsum(x * x, axis=1)], axis=1)
+
+        t = np.arange(history.shape[1])
+        lo = np.maximum(t - self.window_size, 0)
+        n = (t - lo).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (s1[:, t] - s1[:, lo]) / n
+            var = (s2[:, t] - s2[:, lo]) / n - mean ** 2
+        # Same flat-window test as update(), against the uncentered level
+        std = _std(np.nan_to_num(var), np.nan_to_num(mean) + center)
+
+        scores = (x - np.nan_to_num(mean)) / std
+        baselines = np.where(n > 0, mean + center, history)
+        return scores, baselines
+
+
+class Ewma(Detector):
+    """Exponentially weighted mean and standard deviation (window-free)."""
+
+    name = "ewma"
+
+    def __init__(self, window_size: int, capacity: int, alpha: float = 0.1):
+        super().__init__(window_size, capacity)
+        self.alpha = alpha
+        self.seen = np.zeros(capacity, dtype=bool)
+        self.mean = np.zeros(capacity)
+        self.var = np.zeros(capacity)
+
+    def resize(self, capacity: int):
+        super().resize(capacity)
+        self.seen = _grow(self.seen, capacity)
+        self.mean = _grow(self.mean, capacity)
+        self.var = _grow(self.var, capacity)
+
+    def reset(self, rows: np.ndarray):
+        self.seen[rows] = False
+        self.mean[rows] = 0.0
+        self.var[rows] = 0.0
+
+    def export(self, rows):
+        return {"seen": self.seen[rows], "mean": self.mean[rows], "var": self.var[rows]}
+
+    def restore(self, rows, windows, state):
+        self.seen[rows] = state["seen"]
+        self.mean[rows] = state["mean"]
+        self.var[rows] = state["var"]
+
+    def update(self, rows, values, evicted):
+        seen = self.seen[rows]
+        mean = np.where(seen, self.mean[rows], values)
+        var = self.var[rows]
+
+        std = _std(var, mean)
+        scores = (values - mean) / std
+
+        diff = values - mean
+        incr = self.alpha * diff
+        self.mean[rows] = mean + incr
+        self.var[rows] = (1 - self.alpha) * (var + diff * incr)
+        self.seen[rows] = True
+        return scores, mean
+
+    def score_history(self, history):
+        scores = np.zeros_like(history)
+        baselines = np.empty_like(history)
+        mean = history[:, 0].copy()
+        var = np.zeros(len(history))
+        for t in range(history.shape[1]):
+            x = history[:, t]
+            live = ~np.isnan(x)
+            std = _std(var, mean)
+            scores[:, t] = (x - mean) / std
+            baselines[:, t] = mean
+            diff = x - mean
+            incr = self.alpha * diff
+            mean = np.where(live, mean + incr, mean)
+            var = np.where(live, (1 - self.alpha) * (var + diff * incr), var)
+        return scores, baselines
+
+
+def _kth_of_two(left: list, right: list, nl: int, nr: int, med: float, k: int) -> float:
+    """k-th smallest (0-based) absolute deviation from `med` in O(log w).
+
+    `left[:nl]` is the sorted lower half of the window (deviations grow as we
+    walk it backwards), `right[:nr]` the sorted upper half; together they are
+    two sorted deviation sequences and this is the classic two-array selection.
+    """
+    def dl(i):
+        return med - left[nl - 1 - i]
+
+    def dr(j):
+        return right[j] - med
+
+    lo, hi = max(0, k + 1 - nr), min(k + 1, nl)
+    while True:
+        i = (lo + hi) // 2
+        j = k + 1 - i
+        if i > 0 and j < nr and dl(i - 1) > dr(j):
+            hi = i - 1
+        elif j > 0 and i < nl and dr(j - 1) > dl(i):
+            lo = i + 1
+        else:
+            a = dl(i - 1) if i > 0 else -np.inf
+            b = dr(j - 1) if j > 0 else -np.inf
+            return max(a, b)
+
+
+class _SortedView:
+    """Read-only slice of a sorted list without copying it."""
+
+    __slots__ = ("data", "start")
+
+    def __init__(self, data: list, start: int):
+        self.data = data
+        self.start = start
+
+    def __getitem__(self, i):
+        return self.data[self.start + i]
+
+
+def median_mad(window: list) -> tuple[float, float]:
+    """Median and MAD of an already sorted window, without copying it."""
+    n = len(window)
+    half = n // 2
+    med = window[half] if n % 2 else (window[half - 1] + window[half]) / 2
+    right = _SortedView(window, half)
+    if n % 2:
+        mad = _kth_of_two(window, right, half, n - half, med, half)
+    else:
+        mad = (_kth_of_two(window, right, half, n - half, med, half - 1)
+               + _kth_of_two(window, right, half, n - half, med, half)) / 2
+    return med, mad
+
+
+class RollingMedianMad(Detector):
+    """Robust z-score from a rolling median and median absolute deviation.
+
+    Each row keeps its window as a sorted list: removal and insertion are a
+    bisect plus a memmove, the median is an index lookup and the MAD is a
+    two-sorted-sequence selection, so no per-tick sort or rescan happens.
+    """
+
+    name = "mad"
+
+    def __init__(self, window_size: int, capacity: int):
+        super().__init__(window_size, capacity)
+        self.sorted: list[list[float]] = [[] for _ in range(capacity)]
+
+    def resize(self, capacity: int):
+        super().resize(capacity)
+        self.sorted.extend([] for _ in range(capacity - len(self.sorted)))
+
+    def reset(self, rows: np.ndarray):
+        for row in rows:
+            self.sorted[row].clear()
+
+    def restore(self, rows, windows, state):
+        for row, block in zip(rows.tolist(), windows.values[rows]):
+            self.sorted[row] = sorted(block[~np.isnan(block)].tolist())
+
+    def update(self, rows, values, evicted):
+        scores = np.empty(len(rows))
+        baselines = np.empty(len(rows))
+        for i, (row, value, old) in enumerate(zip(rows.tolist(), values.tolist(), evicted.tolist())):
+            window = self.sorted[row]
+            if window:
+                med, mad = median_mad(window)
+                scale = MAD_SCALE * mad or 1.0
+                scores[i] = (value - med) / scale
+                baselines[i] = med
+            else:
+                scores[i] = 0.0
+                baselines[i] = value
+
+            if old == old:  # not NaN: window full, drop the evicted sample
+                del window[bisect_left(window, old)]
+            insort(window, value)
+        return scores, baselines
+
+    def score_history(self, history, max_elements: int = 20_000_000):
+        n, length = history.shape
+        w = self.window_size
+        padded = np.concatenate([np.full((n, w), np.nan), history], axis=1)
+        scores = np.zeros_like(history)
+        baselines = history.copy()
+
+        # Rows are processed in chunks to bound the (rows x samples x window) temporaries
+        chunk = max(1, max_elements // max(length * w, 1))
+        for start in range(0, n, chunk):
+            stop = min(start + chunk, n)
+            windows = sliding_window_view(padded[start:stop], w, axis=1)[:, :length]
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN first windows
+                med = np.nanmedian(windows, axis=2)
+                mad = np.nanmedian(np.abs(windows - med[..., None]), axis=2)
+            scale = MAD_SCALE * mad
+            scale[~(scale > 0)] = 1.0
+            has_prior = ~np.isnan(med)
+            x = history[start:stop]
+            scores[start:stop] = np.where(has_prior, (x - med) / scale, 0.0)
+            baselines[start:stop] = np.where(has_prior, med, x)
+        return scores, baselines
+
+
+DETECTORS = {
+    RollingZScore.name: RollingZScore,
+    Ewma.name: Ewma,
+    RollingMedianMad.name: RollingMedianMad,
+}
+
+
+def make_detector(name: str, window_size: int, capacity: int, **params) -> Detector:
+    try:
+        cls = DETECTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown detector '{name}', expected one of: {', '.join(DETECTORS)}")
+    return cls(window_size, capacity, **params)
+
+
+@dataclass
+class Detection:
+    key: SeriesKey
+    value: float
+    baseline: float
+    score: float
+
+
+class DetectionEngine:
+    """One metric's series windows plus the detector that scores them."""
+
+    def __init__(self, metric_name: str, detector: str, threshold: float, min_samples: int,
+                 window_size: int, capacity: int = 1024, max_idle_ticks: int = 20, **params):
+        self.metric_name = metric_name
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.windows = SeriesWindows(window_size, capacity=capacity, max_idle_ticks=max_idle_ticks)
+        self.detector = make_detector(detector, window_size, capacity, **params)
+        self.last_evaluated = 0
+        # Rows scored by the last observe() and their scores (NaN while warming up)
+        self.last_rows = np.zeros(0, dtype=np.int64)
+        self.last_scores = np.zeros(0)
+        self.last_evicted: list[SeriesKey] = []
+
+    def observe(self, samples: dict[SeriesKey, float], advance: bool = True) -> list[Detection]:
+        """Fold one sample per series into the windows and return anomalies.
+
+        With `advance=False` the idle clock is left alone (see advance_clock).
+        """
+        detections = self._fold(samples, advance)
+        if advance:
+            self.last_evicted = self.windows.evict_idle()
+        return detections
+
+    def advance_clock(self) -> list[SeriesKey]:
+        """Age every series by one tick and evict the idle ones, without new samples."""
+        self.windows.tick += 1
+        self.last_evicted = self.windows.evict_idle()
+        return self.last_evicted
+
+    def seed(self, samples: dict[SeriesKey, float]):
+        """Fold in a historical sample per series without raising anomalies or aging other series."""
+        self._fold(samples, advance=False)
+
+    def forget(self, keys) -> list[SeriesKey]:
+        """Drop series this engine should no longer track."""
+        return self.windows.remove(keys)
+
+    def _fold(self, samples: dict[SeriesKey, float], advance: bool) -> list[Detection]:
+        windows = self.windows
+        rows = windows.assign(samples)
+        values = np.fromiter(samples.values(), dtype=float, count=len(samples))
+        if self.detector.capacity < windows.capacity:
+            self.detector.resize(windows.capacity)
+
+        prior = windows.counts[rows]
+        self.detector.reset(rows[prior == 0])
+        evicted = windows.append(rows, values, advance)
+        scores, baselines = self.detector.update(rows, values, evicted)
+
+        ready = (prior >= 2) & (prior + 1 >= self.min_samples)
+        hits = np.nonzero(ready & (scores > self.threshold))[0]
+        detections = [
+            Detection(windows.keys[rows[i]], float(values[i]), float(baselines[i]), float(scores[i]))
+            for i in hits
+        ]
+
+        self.last_evaluated = len(rows)
+        self.last_rows = rows
+        self.last_scores = np.where(ready, scores, np.nan)
+        return detections
+
+    def export(self) -> dict[str, np.ndarray]:
+        """Compact state of every tracked series, for snapshots."""
+        keys, values, counts, heads = self.windows.snapshot()
+        rows = self.windows.assign(keys)
+        state = {f"detector.{k}": v for k, v in self.detector.export(rows).items()}
+        return {"keys": keys, "values": values, "counts": counts, "heads": heads, **state}
+
+    def restore(self, state: dict):
+        """Load state produced by export()."""
+        rows = self.windows.load(state["keys"], state["values"], state["counts"], state["heads"])
+        if self.detector.capacity < self.windows.capacity:
+            self.detector.resize(self.windows.capacity)
+        self.detector.reset(rows)
+        detector_state = {k.split(".", 1)[1]: v for k, v in state.items() if k.startswith("detector.")}
+        self.detector.restore(rows, self.windows, detector_state)
@@ -0,0 +1,137 @@
+"""
+Anomaly episodes.
+
+Instead of one `anomalies` row per anomalous tick, consecutive anomalous
+ticks of a series form one episode:
+
+  open      score rises above the detection threshold -> one row is inserted
+  ongoing   the row is only updated if the severity (from the peak score)
+            escalates
+  resolved  the score stayed below the exit threshold for `resolve_ticks`
+            evaluations -> the row gets ended_at, peak value and duration
+
+The exit threshold is lower than the entry threshold (hysteresis), so a
+score hovering around the threshold does not flap. A series that turns
+anomalous again within `cooldown` seconds of resolving reopens the same
+episode instead of starting a new one. Ticks where a series returned no
+sample count as quiet, unless `missing_is_quiet` is off (push ingestion,
+where one export only carries some of the series); a series evicted from
+the windows always does.
+"""
+
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import numpy as np
+
+from detectors import Detection, DetectionEngine
+from series import SeriesKey
+from sink import AnomalyRecord, EpisodeUpdate
+
+# Severity bands as multiples of the detection threshold
+SEVERITY_BANDS = [(3.0, "CRITICAL"), (2.0, "HIGH"), (1.5, "MEDIUM")]
+
+
+def severity_for(score: float, threshold: float) -> str:
+    """Severity of a z-score relative to the detection threshold."""
+    for factor, severity in SEVERITY_BANDS:
+        if score >= factor * threshold:
+            return severity
+    return "LOW"
+
+
+@dataclass
+class Episode:
+    episode_id: str
+    started_at: datetime
+    peak_score: float
+    peak_value: float
+    severity: str
+    ended_at: datetime | None = None
+    quiet_ticks: int = 0
+
+    def update(self) -> EpisodeUpdate:
+        duration = (self.ended_at - self.started_at).total_seconds() if self.ended_at else None
+        return EpisodeUpdate(self.episode_id, self.started_at, self.peak_value, self.severity,
+                             self.ended_at, duration)
+
+
+class EpisodeTracker:
+    """Episode state of every series of one metric."""
+
+    def __init__(self, metric_name: str, threshold: float, exit_threshold: float,
+                 resolve_ticks: int = 3, cooldown: float = 300.0,
+                 missing_is_quiet: bool = True, default_service: str = "telemetry-demo-service"):
+        self.metric_name = metric_name
+        self.threshold = threshold
+        self.exit_threshold = exit_threshold
+        self.resolve_ticks = resolve_ticks
+        self.cooldown = cooldown
+        self.missing_is_quiet = missing_is_quiet
+        self.default_service = default_service
+        self.open: dict[SeriesKey, Episode] = {}
+        self.cooling: dict[SeriesKey, Episode] = {}
+
+    def update(self, engine: DetectionEngine, detections: list[Detection],
+               now: datetime | None = None) -> list:
+        """Advance every episode by one tick; returns the writes to queue (inserts and updates)."""
+        now = now or datetime.now(timezone.utc)
+        writes = []
+        hits = {d.key: d for d in detections}
+
+        for key, d in hits.items():
+            episode = self.open.get(key)
+            if episode is not None:
+                episode.quiet_ticks = 0
+                episode.peak_value = max(episode.peak_value, d.value)
+                if d.score > episode.peak_score:
+                    episode.peak_score = d.score
+                    severity = severity_for(d.score, self.threshold)
+                    if severity != episode.severity:
+                        episode.severity = severity
+                        writes.append(episode.update())
+            elif key in self.cooling:
+                # Came back before the cooldown ran out: same incident, reopen it
+                episode = self.open[key] = self.cooling.pop(key)
+                episode.ended_at = None
+                episode.quiet_ticks = 0
+                episode.peak_value = max(episode.peak_value, d.value)
+                if d.score > episode.peak_score:
+                    episode.peak_score = d.score
+                    episode.severity = severity_for(d.score, self.threshold)
+                writes.append(episode.update())
+            else:
+                severity = severity_for(d.score, self.threshold)
+                episode = self.open[key] = Episode(uuid.uuid4().hex, now, d.score, d.value, severity)
+                writes.append(AnomalyRecord(
+                    dict(key).get("service_name", self.default_service), self.metric_name, severity,
+                    d.value, d.baseline, now, episode_id=episode.episode_id, peak_value=d.value,
+                ))
+
+        quiet = [key for key in self.open if key not in hits]
+        if quiet:
+            scores = np.full(engine.windows.capacity, np.nan)
+            scores[engine.last_rows] = engine.last_scores
+            evaluated = np.zeros(engine.windows.capacity, dtype=bool)
+            evaluated[engine.last_rows] = True
+            for key in quiet:
+                episode = self.open[key]
+                row = engine.windows.rows.get(key)
+                if row is not None and not evaluated[row] and not self.missing_is_quiet:
+                    continue
+                score = scores[row] if row is not None else np.nan
+                if score >= self.exit_threshold:
+                    # Between the exit and entry thresholds: still part of the episode
+                    episode.quiet_ticks = 0
+                    continue
+                episode.quiet_ticks += 1
+                if episode.quiet_ticks >= self.resolve_ticks:
+                    episode.ended_at = now
+                    writes.append(episode.update())
+                    self.cooling[key] = self.open.pop(key)
+
+        expired = [k for k, e in self.cooling.items() if (now - e.ended_at).total_seconds() > self.cooldown]
+        for key in expired:
+            del self.cooling[key]
+        return writes
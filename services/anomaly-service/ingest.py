@@ -0,0 +1,189 @@
+"""
+Push ingestion: an OTLP/HTTP metrics receiver.
+
+The otel-collector fans metrics out to POST /v1/metrics (JSON encoding)
+next to its Prometheus exporter. Histogram points of the configured
+metrics are turned into per-export bucket deltas (cumulative points are
+differenced against the previous export of the same stream), summed per
+series the same way SERIES_QUERY groups them, and reduced to a quantile
+that feeds the detector as soon as the export arrives, instead of waiting
+for the next poll and a 5m rate() window.
+
+Requests are only parsed and queued in the handler; a single consumer does
+the decoding. The queue is bounded: when it is full the receiver answers
+503, which the collector retries with backoff, so a slow detector pushes
+back on the collector instead of growing memory.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+from aiohttp import web
+
+from instrumentation import INGEST_QUEUE_DEPTH, INGEST_REQUESTS
+from quantiles import histogram_quantiles
+from series import SeriesKey
+from util import log
+
+# OTLP AggregationTemporality
+DELTA = 1
+CUMULATIVE = 2
+
+UNIT_SCALE = {"ms": 1000.0, "milliseconds": 1000.0, "us": 1e6, "s": 1.0, "seconds": 1.0}
+
+
+def attributes(attrs: list[dict]) -> dict[str, str]:
+    """OTLP KeyValue list -> labels, with dots replaced like the Prometheus exporter does."""
+    labels = {}
+    for attr in attrs or []:
+        value = attr.get("value", {})
+        labels[attr["key"].replace(".", "_")] = str(next(iter(value.values()), ""))
+    return labels
+
+
+class HistogramDeltas:
+    """Turns OTLP histogram points into bucket counts observed since the previous export.
+
+    The previous point of every cumulative stream is kept until the stream
+    has not been exported for `max_idle` seconds, so streams that stop
+    (a finished pod, a one-off status or exception label) do not pile up.
+    """
+
+    def __init__(self, max_idle: float = 600.0):
+        self.max_idle = max_idle
+        # stream -> (start time, cumulative counts, monotonic time last seen)
+        self.last: dict[tuple, tuple[str, np.ndarray, float]] = {}
+        self._next_sweep = time.monotonic() + max_idle
+
+    def __call__(self, stream: tuple, point: dict, temporality: int) -> np.ndarray | None:
+        counts = np.array(point.get("bucketCounts", []), dtype=float)
+        if temporality != CUMULATIVE:
+            return counts
+        start = point.get("startTimeUnixNano", "")
+        previous = self.last.get(stream)
+        self.last[stream] = (start, counts, time.monotonic())
+        if previous is None:
+            return None
+        prev_start, prev_counts, _ = previous
+        if prev_start != start:
+            # The exporter restarted: everything counted since its new start time is new
+            return counts
+        if prev_counts.shape != counts.shape or (counts < prev_counts).any():
+            return None
+        return counts - prev_counts
+
+    def evict_idle(self, now: float | None = None) -> int:
+        """Forget streams not seen for max_idle seconds; sweeps at most every max_idle / 10 seconds."""
+        now = time.monotonic() if now is None else now
+        if now < self._next_sweep:
+            return 0
+        self._next_sweep = now + self.max_idle / 10
+        idle = [stream for stream, (_, _, seen) in self.last.items() if now - seen > self.max_idle]
+        for stream in idle:
+            del self.last[stream]
+        return len(idle)
+
+
+class OtlpReceiver:
+    def __init__(self, metrics: list[str], group_by: list[str], quantile: float = 0.95,
+                 max_queue: int = 256, max_body: int = 8 * 1024 * 1024, stream_idle: float = 600.0):
+        self.metrics = set(metrics)
+        self.group_by = list(group_by)
+        self.quantile = quantile
+        self.max_body = max_body
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(max_queue)
+        self.deltas = HistogramDeltas(stream_idle)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, port: int):
+        app = web.Application(client_max_size=self.max_body)
+        app.router.add_post("/v1/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "0.0.0.0", port).start()
+        INGEST_QUEUE_DEPTH.set_function(self.queue.qsize)
+        log(f"Receiving OTLP/HTTP metrics on :{port}/v1/metrics ({', '.join(sorted(self.metrics))})")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.queue.full():
+            # Refuse before reading the body; the collector retries with backoff
+            INGEST_REQUESTS.labels("throttled").inc()
+            return web.json_response({"message": "ingest queue full"}, status=503,
+                                     headers={"Retry-After": "1"})
+        if request.content_type != "application/json":
+            INGEST_REQUESTS.labels("unsupported").inc()
+            return web.json_response({"message": "only the OTLP JSON encoding is supported"},
+                                     status=415)
+        try:
+            body = await request.json()
+        except ValueError as e:
+            INGEST_REQUESTS.labels("invalid").inc()
+            return web.json_response({"message": f"invalid JSON: {e}"}, status=400)
+
+        try:
+            self.queue.put_nowait(body)
+        except asyncio.QueueFull:
+            INGEST_REQUESTS.labels("throttled").inc()
+            return web.json_response({"message": "ingest queue full"}, status=503,
+                                     headers={"Retry-After": "1"})
+        INGEST_REQUESTS.labels("accepted").inc()
+        return web.json_response({})
+
+    def decode(self, body: dict) -> dict[SeriesKey, float]:
+        """One ExportMetricsServiceRequest -> series key -> quantile (seconds)."""
+        grouped: dict[SeriesKey, tuple[np.ndarray, np.ndarray]] = {}
+        for resource_metrics in body.get("resourceMetrics", []):
+            resource = attributes(resource_metrics.get("resource", {}).get("attributes"))
+            for scope_metrics in resource_metrics.get("scopeMetrics", []):
+                for metric in scope_metrics.get("metrics", []):
+                    if metric.get("name") not in self.metrics or "histogram" not in metric:
+                        continue
+                    scale = UNIT_SCALE.get(metric.get("unit", "s"), 1.0)
+                    histogram = metric["histogram"]
+                    temporality = histogram.get("aggregationTemporality", CUMULATIVE)
+                    for point in histogram.get("dataPoints", []):
+                        labels = {**resource, **attributes(point.get("attributes"))}
+                        stream = (metric["name"], tuple(sorted(labels.items())))
+                        counts = self.deltas(stream, point, temporality)
+                        if counts is None or not counts.any():
+                            continue
+                        bounds = np.array(point.get("explicitBounds", []), dtype=float) / scale
+                        key = tuple(sorted((k, labels[k]) for k in self.group_by if k in labels))
+                        if key not in grouped:
+                            grouped[key] = (bounds, counts)
+                        elif np.array_equal(grouped[key][0], bounds) and grouped[key][1].shape == counts.shape:
+                            grouped[key] = (bounds, grouped[key][1] + counts)
+                        else:
+                            # Buckets that do not line up cannot be summed; keep what was summed so far
+                            log(f"Skipping {metric['name']} point for {dict(key)}: "
+                                f"bucket layout differs from the series' other points")
+
+        self.deltas.evict_idle()
+
+        # One vectorized quantile pass per bucket layout
+        layouts: dict[tuple, list[SeriesKey]] = {}
+        for key, (bounds, _) in grouped.items():
+            layouts.setdefault(tuple(bounds), []).append(key)
+        samples = {}
+        for bounds, keys in layouts.items():
+            cumulative = np.cumsum([grouped[k][1] for k in keys], axis=1)
+            values = histogram_quantiles(np.array([*bounds, np.inf]), cumulative, [self.quantile])[:, 0]
+            samples.update((k, float(v)) for k, v in zip(keys, values) if not np.isnan(v))
+        return samples
+
+    async def batches(self):
+        """Decoded samples of each accepted export, in arrival order."""
+        while True:
+            body = await self.queue.get()
+            try:
+                samples = self.decode(body)
+            except Exception as e:
+                log(f"Could not decode OTLP export: {e!r}")
+                continue
+            if samples:
+                yield samples
@@ -0,0 +1,74 @@
+"""
+Self-instrumentation for anomaly-service.
+
+Metrics about the detection loop itself, served on METRICS_PORT for the
+same Prometheus that feeds the service, so it can alert when the detector
+(rather than the watched services) is the bottleneck.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from detectors import DetectionEngine
+from util import log
+
+# Detection compute is a NumPy pass over all series: sub-millisecond to ~1s
+COMPUTE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+TICK_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0)
+
+TICK_SECONDS = Histogram(
+    "anomaly_tick_duration_seconds", "Wall time of one detection tick", buckets=TICK_BUCKETS)
+TICKS_SKIPPED = Counter(
+    "anomaly_ticks_skipped_total", "Tick slots skipped because the previous tick overran")
+QUERY_SECONDS = Histogram(
+    "anomaly_prom_query_duration_seconds", "Latency of Prometheus API requests", ["endpoint"])
+QUERY_ERRORS = Counter(
+    "anomaly_prom_query_errors_total", "Prometheus API requests that failed", ["endpoint"])
+DETECTION_SECONDS = Histogram(
+    "anomaly_detection_duration_seconds", "Time to fold one tick of samples into a detector",
+    ["metric"], buckets=COMPUTE_BUCKETS)
+FLUSH_SECONDS = Histogram(
+    "anomaly_db_flush_duration_seconds", "Latency of one batched anomaly insert")
+
+FALLBACK_QUERIES = Counter(
+    "anomaly_fallback_queries_total", "Ticks served by a query other than the configured one",
+    ["metric"])
+NAN_SKIPS = Counter(
+    "anomaly_nan_samples_skipped_total", "NaN/Inf samples dropped while decoding query results")
+INSERT_FAILURES = Counter(
+    "anomaly_insert_failures_total", "Anomaly inserts that failed and were spilled to disk")
+DB_ERRORS = Counter(
+    "anomaly_db_errors_total", "Failed Postgres connection attempts and writes of the anomaly writer")
+ANOMALIES_WRITTEN = Counter(
+    "anomaly_records_written_total", "Anomalies inserted into Postgres")
+ANOMALIES_DETECTED = Counter(
+    "anomaly_detections_total", "Anomalies raised by the detectors", ["metric"])
+
+TRACKED_SERIES = Gauge(
+    "anomaly_tracked_series", "Series with a detection window", ["metric"])
+WINDOW_FILL = Gauge(
+    "anomaly_window_fill_ratio", "Mean fraction of the window filled across tracked series", ["metric"])
+WRITE_QUEUE_DEPTH = Gauge(
+    "anomaly_write_queue_depth", "Anomalies queued for insert")
+
+INGEST_REQUESTS = Counter(
+    "anomaly_ingest_requests_total", "OTLP export requests received, by outcome", ["outcome"])
+INGEST_QUEUE_DEPTH = Gauge(
+    "anomaly_ingest_queue_depth", "OTLP exports waiting to be decoded")
+
+
+def start_metrics_server(port: int):
+    """Serve /metrics in a background thread; port 0 disables it."""
+    if port:
+        start_http_server(port)
+        log(f"Serving metrics on :{port}/metrics")
+
+
+def record_engine(engine: DetectionEngine, detections: int, seconds: float):
+    """Export one engine's per-tick numbers after observe()."""
+    name = engine.metric_name
+    windows = engine.windows
+    DETECTION_SECONDS.labels(name).observe(seconds)
+    ANOMALIES_DETECTED.labels(name).inc(detections)
+    TRACKED_SERIES.labels(name).set(len(windows))
+    filled = windows.counts[windows.occupied]
+    WINDOW_FILL.labels(name).set(filled.mean() / windows.window_size if len(filled) else 0.0)
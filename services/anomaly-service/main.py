@@ -1,9 +1,25 @@
+import asyncio
 import os
+import signal
+import sys
 import time
 import requests
 import psycopg2
-import psycopg2.extras
-import numpy as np
+
+from detectors import DetectionEngine
+from episodes import EpisodeTracker
+from ingest import OtlpReceiver
+from instrumentation import record_engine, start_metrics_server
+from partitions import PartitionManager
+from prom import PromClient, unit_scale
+from resolver import QueryResolver
+from scheduler import run_fixed_rate
+from series import series_name
+from sharding import ShardAssignment, metric_names
+from signals import combined_query, signal_queries, split_signals
+from sink import AnomalyWriter
+from snapshot import Snapshotter, seed_from_history, warm_start
+from util import log
 
 # Prometheus URL - uses service name for Docker, or localhost for host testing
 # Inside Docker: http://prometheus:9090 (service name)
@@ -14,6 +30,8 @@ PG_HOST = os.getenv("PG_HOST", "postgres")
 PG_DB = os.getenv("PG_DB", "observability")
 PG_USER = os.getenv("PG_USER", "admin")
 PG_PASSWORD = os.getenv("PG_PASSWORD", "admin")
+# Seconds one connection attempt may take, so an unreachable host cannot stall shutdown
+PG_CONNECT_TIMEOUT = int(os.getenv("PG_CONNECT_TIMEOUT", "3"))
 
 OTEL_RESOURCE_ATTRIBUTES="service.name=anomaly-service"
 
@@ -24,20 +42,127 @@ OTEL_RESOURCE_ATTRIBUTES="service.name=anomaly-service"
 # - http_server_requests_seconds_bucket (Micrometer with seconds)
 # - http_server_request_duration_seconds_bucket (OpenTelemetry semantic)
 # Make query configurable via environment variable
-# If using milliseconds, result will be in ms - we convert to seconds in fetch_p95_latency()
+# If using milliseconds, result will be in ms - we convert to seconds when decoding (prom.unit_scale)
 # Using 5m window for more stable results (histogram_quantile needs sufficient data)
 DEFAULT_QUERY = 'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket[5m])) by (le))'
 QUERY = os.getenv("PROMETHEUS_QUERY", DEFAULT_QUERY)
-WINDOW_SIZE = 10
-latency_window: list[float] = []
 
+# Histogram metric names we know how to build a latency query for
+METRIC_PATTERNS = [
+    "http_server_requests_milliseconds_bucket",
+    "http_server_requests_seconds_bucket",
+    "http_server_request_duration_seconds_bucket",
+    "http_server_request_duration_milliseconds_bucket",
+]
+QUERY_TEMPLATE = 'histogram_quantile(0.95, sum(rate({metric}[5m])) by (le))'
+# Fallbacks tried (in order) when QUERY returns nothing
+ALTERNATIVE_QUERIES = [
+    # Milliseconds variants
+    'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket[1m])) by (le))',
+    'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket[5m])) by (le))',
+
+    # With service name filter
+    'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket{service_name="telemetry-demo-service"}[1m])) by (le))',
+    'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket{service_name="telemetry-demo-service"}[5m])) by (le))'
+]
+# How long a working query is trusted before it is re-validated in the background,
+# and how long a metric name that does not exist is skipped
+QUERY_RESOLVE_TTL = float(os.getenv("QUERY_RESOLVE_TTL", "300"))
+QUERY_NEGATIVE_TTL = float(os.getenv("QUERY_NEGATIVE_TTL", "600"))
+
+# Detection settings
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "2.5"))  # Lower default
+MIN_WINDOW_SIZE = int(os.getenv("MIN_WINDOW_SIZE", "3"))  # Lower from 5 to 3
+WINDOW_SIZE = int(os.getenv("WINDOW_SIZE", "10"))
+# Detector per metric: zscore (rolling Welford), ewma (EWMA/EWMSTD) or mad (rolling median/MAD).
+# DETECTOR is the default; METRIC_DETECTORS overrides it, e.g. "p95_latency=mad"
+DETECTOR = os.getenv("DETECTOR", "zscore")
+METRIC_DETECTORS = dict(
+    item.split("=", 1) for item in os.getenv("METRIC_DETECTORS", "").split(",") if "=" in item
+)
+EWMA_ALPHA = float(os.getenv("EWMA_ALPHA", "0.1"))
+# Anomaly episodes: an episode ends once the score has stayed below EPISODE_EXIT_THRESHOLD
+# for EPISODE_RESOLVE_TICKS ticks; a recurrence within EPISODE_COOLDOWN seconds reopens it
+EPISODE_EXIT_THRESHOLD = float(os.getenv("EPISODE_EXIT_THRESHOLD", "1.5"))
+EPISODE_RESOLVE_TICKS = int(os.getenv("EPISODE_RESOLVE_TICKS", "3"))
+EPISODE_COOLDOWN = float(os.getenv("EPISODE_COOLDOWN", "300"))
+
+# "single" watches the one aggregate QUERY series above; "multi" issues one
+# grouped query and tracks every returned label set in its own window.
+DETECTION_MODE = os.getenv("DETECTION_MODE", "single")
+# Grouped p95 query, used by replay.py and to seed push mode
+DEFAULT_SERIES_QUERY = 'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket[5m])) by (le, service_name, uri))'
+SERIES_QUERY = os.getenv("SERIES_QUERY", DEFAULT_SERIES_QUERY)
+# Signals watched in multi mode only (single mode keeps to QUERY), all fetched in one combined query (see signals.py):
+# p95_latency, error_ratio and/or request_rate, built on SIGNAL_METRIC and grouped by SIGNAL_GROUP_BY
+SIGNALS = [s for s in os.getenv("SIGNALS", "p95_latency,error_ratio,request_rate").split(",") if s]
+SIGNAL_METRIC = os.getenv("SIGNAL_METRIC", "http_server_requests_milliseconds_bucket")
+SIGNAL_GROUP_BY = os.getenv("SIGNAL_GROUP_BY", "service_name, uri")
+SIGNAL_ERROR_MATCHER = os.getenv("SIGNAL_ERROR_MATCHER", 'status=~"5.."')
+# "server": one histogram_quantile per latency signal; "client": fetch the bucket rates once and
+# compute every pNN_latency signal locally in one NumPy pass (quantiles.py)
+QUANTILE_MODE = os.getenv("QUANTILE_MODE", "server")
+SERIES_CAPACITY = int(os.getenv("SERIES_CAPACITY", "1024"))  # initial rows, grows on demand
+SERIES_IDLE_TICKS = int(os.getenv("SERIES_IDLE_TICKS", "20"))  # evict series missing this many ticks
+# Additional grouped queries for multi mode, each with its own detector: "name=promql;name=promql"
+EXTRA_SERIES_QUERIES = dict(
+    item.split("=", 1) for item in os.getenv("EXTRA_SERIES_QUERIES", "").split(";") if "=" in item
+)
+
+# Scheduling: ticks run on a fixed-rate clock; queries within a tick run concurrently
+TICK_INTERVAL = float(os.getenv("TICK_INTERVAL", "15"))
+PROM_MAX_CONCURRENCY = int(os.getenv("PROM_MAX_CONCURRENCY", "8"))
+PROM_TIMEOUT = float(os.getenv("PROM_TIMEOUT", "10"))
+
+# Anomaly writes are queued and flushed in batches; spilled to SPILL_PATH while Postgres is down
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "1.0"))
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "10000"))
+SPILL_PATH = os.getenv("SPILL_PATH", "anomalies.spill.jsonl")
+# Daily partitions of the anomalies table: kept ANOMALY_RETENTION_DAYS, created PARTITION_PREMAKE_DAYS
+# ahead, checked every PARTITION_MAINTENANCE_INTERVAL seconds
+ANOMALY_RETENTION_DAYS = int(os.getenv("ANOMALY_RETENTION_DAYS", "30"))
+PARTITION_PREMAKE_DAYS = int(os.getenv("PARTITION_PREMAKE_DAYS", "2"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+# Detector state is snapshotted periodically and restored at startup if younger than SNAPSHOT_MAX_AGE;
+# otherwise the windows are seeded from query_range history
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "detector-state.npz")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", "900"))
+
+# Sharding (multi mode): with SHARD_COUNT > 1 each replica only queries and tracks the series whose
+# SHARD_LABEL value hashes to its SHARD_INDEX; label values are re-read every SHARD_REFRESH_INTERVAL
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_LABEL = os.getenv("SHARD_LABEL", "service_name")
+SHARD_REFRESH_INTERVAL = float(os.getenv("SHARD_REFRESH_INTERVAL", "60"))
+if SHARD_COUNT > 1:
+    # Replicas may share a state volume
+    root, ext = os.path.splitext(SNAPSHOT_PATH)
+    SNAPSHOT_PATH = f"{root}.shard-{SHARD_INDEX}{ext}"
+    root, ext = os.path.splitext(SPILL_PATH)
+    SPILL_PATH = f"{root}.shard-{SHARD_INDEX}{ext}"
 
-def log(msg: str):
-    print(f"[anomaly-service] {msg}", flush=True)
+# "poll" queries Prometheus every tick; "push" receives OTLP/HTTP (JSON) metrics from the
+# otel-collector on INGEST_PORT and scores each export as it arrives (DETECTION_MODE is ignored)
+INGEST_MODE = os.getenv("INGEST_MODE", "poll")
+INGEST_PORT = int(os.getenv("INGEST_PORT", "4320"))
+INGEST_METRICS = os.getenv("INGEST_METRICS", "http.server.requests,http.server.request.duration").split(",")
+INGEST_GROUP_BY = os.getenv("INGEST_GROUP_BY", "service_name,uri").split(",")
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "256"))  # exports; 503 when full
+# Seconds a cumulative OTLP stream may go unexported before its last point is forgotten
+INGEST_STREAM_IDLE = float(os.getenv("INGEST_STREAM_IDLE", "600"))
 
+# Self-instrumentation: Prometheus metrics about the detection loop (0 disables)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
 
-def get_pg_conn():
-    """Retryable Postgres connection."""
+# Keep-alive session for the synchronous diagnostic/fallback helpers
+http = requests.Session()
+
+
+def get_pg_conn(retry: bool = True):
+    """Retryable Postgres connection; with retry=False a failed attempt raises instead."""
     while True:
         try:
             conn = psycopg2.connect(
@@ -45,11 +170,14 @@ def get_pg_conn():
                 dbname=PG_DB,
                 user=PG_USER,
                 password=PG_PASSWORD,
+                connect_timeout=PG_CONNECT_TIMEOUT,
             )
             conn.autocommit = True
             log("Connected to Postgres")
             return conn
         except Exception as e:
+            if not retry:
+                raise
             log(f"Postgres not ready or unreachable at {PG_HOST}: {e}. Retrying in 3s...")
             time.sleep(3)
 
@@ -60,7 +188,7 @@ def check_metric_has_data(metric_name: str) -> bool:
         base_url = PROM_URL.replace("/api/v1/query", "")
         # Query for the metric count to see if it has data
         query = f"count({metric_name})"
-        resp = requests.get(PROM_URL, params={"query": query}, timeout=5)
+        resp = http.get(PROM_URL, params={"query": query}, timeout=5)
         if resp.status_code == 200:
             data = resp.json()
             if data.get("status") == "success":
@@ -80,7 +208,7 @@ def check_metric_has_le_label(metric_name: str) -> bool:
         series_url = f"{base_url}/api/v1/series"
         
         # Check for the metric with an 'le' label
-        resp = requests.get(series_url, params={"match[]": f'{metric_name}{{le!=""}}'}, timeout=5)
+        resp = http.get(series_url, params={"match[]": f'{metric_name}{{le!=""}}'}, timeout=5)
         if resp.status_code == 200:
             data = resp.json()
             if data.get("data") and len(data["data"]) > 0:
@@ -97,21 +225,14 @@ def check_metric_has_le_label(metric_name: str) -> bool:
 
 def discover_metrics() -> list[str]:
     """Discover available HTTP request metrics in Prometheus."""
-    metric_patterns = [
-        "http_server_requests_milliseconds_bucket",
-        "http_server_requests_seconds_bucket",
-        "http_server_request_duration_seconds_bucket",
-        "http_server_request_duration_milliseconds_bucket",
-    ]
-    
     found_metrics = []
     base_url = PROM_URL.replace("/api/v1/query", "")
     
-    for pattern in metric_patterns:
+    for pattern in METRIC_PATTERNS:
         try:
             # Use Prometheus series API to check if metric exists
             series_url = f"{base_url}/api/v1/series"
-            resp = requests.get(series_url, params={"match[]": f"{pattern}"}, timeout=5)
+            resp = http.get(series_url, params={"match[]": f"{pattern}"}, timeout=5)
             if resp.status_code == 200:
                 data = resp.json()
                 if data.get("data"):
@@ -129,148 +250,238 @@ def discover_metrics() -> list[str]:
     return found_metrics
 
 
-def try_alternative_queries() -> float | None:
-    """Try multiple query variations to find one that works."""
-    queries_to_try = [
-        # Milliseconds variants
-        'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket[1m])) by (le))',
-        'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket[5m])) by (le))',
-        
-        # With service name filter
-        'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket{service_name="telemetry-demo-service"}[1m])) by (le))',
-        'histogram_quantile(0.95, sum(rate(http_server_requests_milliseconds_bucket{service_name="telemetry-demo-service"}[5m])) by (le))'
-    ]
-    
-    for query in queries_to_try:
+def signal_set(metric: str, names=None, client_quantiles: bool | None = None) -> dict[str, str]:
+    """PromQL of the configured signals (or `names`), built on one histogram metric."""
+    if client_quantiles is None:
+        client_quantiles = QUANTILE_MODE == "client"
+    return signal_queries(metric, names or SIGNALS, SIGNAL_GROUP_BY, SIGNAL_ERROR_MATCHER,
+                          client_quantiles)
+
+
+def signals_query(metric: str) -> str:
+    return combined_query(signal_set(metric))
+
+
+def make_engine(metric_name: str, capacity: int = 1) -> DetectionEngine:
+    """Build the configured detector for a metric."""
+    detector = METRIC_DETECTORS.get(metric_name, DETECTOR)
+    params = {"alpha": EWMA_ALPHA} if detector == "ewma" else {}
+    return DetectionEngine(metric_name, detector, ANOMALY_THRESHOLD, MIN_WINDOW_SIZE, WINDOW_SIZE,
+                           capacity=capacity, max_idle_ticks=SERIES_IDLE_TICKS, **params)
+
+
+def make_tracker(metric_name: str, missing_is_quiet: bool = True) -> EpisodeTracker:
+    return EpisodeTracker(metric_name, ANOMALY_THRESHOLD, EPISODE_EXIT_THRESHOLD, EPISODE_RESOLVE_TICKS,
+                          EPISODE_COOLDOWN, missing_is_quiet)
+
+
+async def run_multi_series(writer: AnomalyWriter):
+    """Detection loop for DETECTION_MODE=multi: one query and one NumPy pass per signal per tick."""
+    names = [*SIGNALS, *EXTRA_SERIES_QUERIES]
+    engines = {name: make_engine(name, capacity=SERIES_CAPACITY) for name in names}
+    trackers = {name: make_tracker(name) for name in names}
+    log(f"Signals query: {signals_query(SIGNAL_METRIC)}")
+    for name, query in EXTRA_SERIES_QUERIES.items():
+        log(f"Series query [{name}]: {query}")
+
+    # Which histogram metric each candidate signals query is built on
+    signal_metrics = {signals_query(m): m for m in [SIGNAL_METRIC, *METRIC_PATTERNS]}
+
+    async with PromClient(PROM_URL, PROM_MAX_CONCURRENCY, PROM_TIMEOUT) as prom:
+        shard = None
+        if SHARD_COUNT > 1:
+            shard = ShardAssignment(prom, SHARD_INDEX, SHARD_COUNT, SHARD_LABEL,
+                                    [*metric_names([*signal_metrics, *EXTRA_SERIES_QUERIES.values()]),
+                                     *METRIC_PATTERNS],
+                                    SHARD_REFRESH_INTERVAL)
+            await shard.refresh()
+            log(f"Running as {shard}, owning {len(shard.owned)} values")
+        rewrite = shard.rewrite if shard else None
+
+        # Signal values are already converted inside PromQL, hence scale=1
+        resolvers = {"signals": QueryResolver(
+            prom, signals_query(SIGNAL_METRIC), template=signals_query, patterns=METRIC_PATTERNS,
+            ttl=QUERY_RESOLVE_TTL, negative_ttl=QUERY_NEGATIVE_TTL, rewrite=rewrite, name="signals",
+            scale=1.0,
+        )}
+        for name, query in EXTRA_SERIES_QUERIES.items():
+            resolvers[name] = QueryResolver(prom, query, ttl=QUERY_RESOLVE_TTL,
+                                            negative_ttl=QUERY_NEGATIVE_TTL, rewrite=rewrite, name=name)
+
+        def history_query(name: str) -> tuple[str, float | None]:
+            """Per-engine query (and scale) for seeding windows from query_range."""
+            if name in EXTRA_SERIES_QUERIES:
+                return resolvers[name].active, None
+            metric = signal_metrics.get(resolvers["signals"].active, SIGNAL_METRIC)
+            # History is seeded once, so latency signals use histogram_quantile even in client mode
+            return signal_set(metric, [name], client_quantiles=False)[name], 1.0
+
+        snapshots = Snapshotter(SNAPSHOT_PATH, SNAPSHOT_INTERVAL, SNAPSHOT_MAX_AGE)
+        history = {name: history_query(name) for name in engines}
+        await warm_start(snapshots, engines,
+                         {n: shard.rewrite(q) if shard else q for n, (q, _) in history.items()},
+                         prom, TICK_INTERVAL, {n: scale for n, (_, scale) in history.items()})
+
+        def handoff():
+            for name, engine in engines.items():
+                dropped = engine.forget([k for k in engine.windows.rows if not shard.owns_key(k)])
+                if dropped:
+                    log(f"Handed off {len(dropped)} {name} series")
+
+        async def take_over(gained: dict[str, set[str]]):
+            # Newly owned series start from their recent history rather than cold
+            seeds = []
+            for name, values in gained.items():
+                query, scale = history_query(name)
+                if values:
+                    seeds.append(seed_from_history(engines[name], prom, shard.rewrite(query, values),
+                                                   TICK_INTERVAL, scale))
+            await asyncio.gather(*seeds)
+
+        if shard:
+            # A snapshot taken under another shard layout: keep what is still owned, seed the rest
+            handoff()
+            await take_over({
+                name: shard.owned - {dict(k).get(SHARD_LABEL, "") for k in engine.windows.rows}
+                for name, engine in engines.items() if len(engine.windows)
+            })
+
+        async def tick():
+            if shard and shard.due():
+                added, removed = await shard.refresh()
+                if removed:
+                    handoff()
+                if added:
+                    await take_over({name: added for name in engines})
+
+            results = dict(zip(resolvers, await asyncio.gather(*(r.fetch() for r in resolvers.values()))))
+            metric = signal_metrics.get(resolvers["signals"].active, SIGNAL_METRIC)
+            by_engine = {**split_signals(results.pop("signals"), SIGNALS, unit_scale(metric)), **results}
+            for name, samples in by_engine.items():
+                engine = engines[name]
+                started = time.perf_counter()
+                detections = engine.observe(samples)
+                record_engine(engine, len(detections), time.perf_counter() - started)
+                if engine.last_evicted:
+                    log(f"Evicted {len(engine.last_evicted)} idle {name} series")
+                if engine.last_evaluated:
+                    log(f"Evaluated {engine.last_evaluated} {name} series ({len(engine.windows)} tracked), "
+                        f"{len(detections)} anomalous")
+
+                for d in detections:
+                    log(f"Anomaly detected for {name}{series_name(d.key)}: value={d.value:.3f}, "
+                        f"baseline={d.baseline:.3f}, score={d.score:.2f}")
+                for write in trackers[name].update(engine, detections):
+                    writer.submit(write)
+
+            await snapshots.maybe_save(engines)
+
         try:
-            resp = requests.get(PROM_URL, params={"query": query}, timeout=5)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            if data.get("status") == "error":
-                continue
-            
-            result = data.get("data", {}).get("result", [])
-            if result:
-                value_str = result[0]["value"][1]
-                value = float(value_str)
-                
-                # Skip NaN or invalid values
-                if value_str in ["NaN", "nan", "+Inf", "-Inf"] or (isinstance(value, float) and value != value):
-                    continue
-                
-                # Convert milliseconds to seconds if needed
-                if "milliseconds" in query.lower():
-                    value = value / 1000.0
-                
-                log(f"Successfully found data with query: {query}")
-                log(f"Result: {value:.3f}s")
-                return value
-        except Exception:
-            continue
-    
-    return None
+            await run_fixed_rate(TICK_INTERVAL, tick)
+        finally:
+            snapshots.save(engines)
 
 
-def fetch_p95_latency() -> float | None:
-    """Query Prometheus for p95 latency. Returns None if no data yet."""
-    try:
-        resp = requests.get(PROM_URL, params={"query": QUERY}, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        
-        # Check for Prometheus query errors
-        if data.get("status") == "error":
-            error_msg = data.get("error", "Unknown error")
-            log(f"Prometheus query error: {error_msg}")
-            log(f"Query used: {QUERY}")
-            log("Attempting to discover available metrics and try alternative queries...")
-            
-            # Try to discover metrics
-            found = discover_metrics()
-            if found:
-                log(f"Found {len(found)} matching metrics: {found}")
-            else:
-                log("No HTTP request metrics found. Make sure:")
-                log("  1. Telemetry-demo-service is running and receiving requests")
-                log("  2. Metrics are being exported to OpenTelemetry Collector")
-                log("  3. Prometheus is scraping the collector")
-                log("  4. Try: curl http://localhost:8080/checkout to generate metrics")
-            
-            # Try alternative queries
-            return try_alternative_queries()
-        
-        result = data.get("data", {}).get("result", [])
-        if not result:
-            log(f"No latency data from Prometheus. Query: {QUERY}")
-            log("Attempting alternative queries...")
-            
-            # Try alternative queries
-            alt_result = try_alternative_queries()
-            if alt_result is not None:
-                return alt_result
-            
-            log("No data found with any query variant. Possible issues:")
-            log("  1. No requests have been made to telemetry-demo-service yet")
-            log("  2. Metric name doesn't match (check Prometheus UI at http://localhost:9090)")
-            log("  3. Time range issue - try increasing [1m] to [5m] or [10m]")
-            log("  4. Check Prometheus targets: http://localhost:9090/targets")
-            return None
-        
-        # Log the raw result for debugging
-        if len(result) > 0:
-            log(f"Raw Prometheus result: {result[0]}")
-
-        # Extract value from Prometheus response
-        # Prometheus returns: [timestamp, "value_as_string"]
-        value_str = result[0]["value"][1]
-        value = float(value_str)
-        
-        # Check for NaN or invalid values
-        if value_str in ["NaN", "nan", "+Inf", "-Inf", "+Infinity", "-Infinity"] or (isinstance(value, float) and (value != value or value == float('inf') or value == float('-inf'))):
-            log(f"Prometheus returned invalid value: {value_str}")
-            log(f"Full result: {result[0]}")
-            log("This usually means:")
-            log("  1. No data in the time range - try increasing [1m] to [5m]")
-            log("  2. Metric doesn't exist or has no samples")
-            log("  3. Query is incorrect")
-            return None
-        
-        # Convert milliseconds to seconds if metric is in milliseconds
-        # Check if query uses milliseconds bucket
-        if "milliseconds" in QUERY.lower():
-            original_ms = value
-            value = value / 1000.0  # Convert ms to seconds
-            log(f"Converted latency from {original_ms:.1f}ms to {value:.3f}s")
-        
-        return value
-    except Exception as e:
-        log(f"Error querying Prometheus: {e}")
-        log(f"Query used: {QUERY}")
-        log("Attempting alternative queries...")
-        return try_alternative_queries()
+async def run_single_series(writer: AnomalyWriter):
+    """Detection loop for the single aggregate QUERY series."""
+    engine = make_engine("p95_latency")
+    tracker = make_tracker("p95_latency")
+    key = ()  # the single aggregate series has no labels
 
+    async with PromClient(PROM_URL, PROM_MAX_CONCURRENCY, PROM_TIMEOUT) as prom:
+        resolver = QueryResolver(
+            prom, QUERY, ALTERNATIVE_QUERIES, template=QUERY_TEMPLATE, patterns=METRIC_PATTERNS,
+            ttl=QUERY_RESOLVE_TTL, negative_ttl=QUERY_NEGATIVE_TTL, name="p95_latency",
+        )
+        engines = {"p95_latency": engine}
+        snapshots = Snapshotter(SNAPSHOT_PATH, SNAPSHOT_INTERVAL, SNAPSHOT_MAX_AGE)
+        await warm_start(snapshots, engines, {"p95_latency": QUERY}, prom, TICK_INTERVAL)
 
-def detect_anomaly(window: list[float], threshold: float = 3.0) -> bool:
-    """Very simple z-score anomaly detection."""
-    if len(window) < 3:
-        return False
-    arr = np.array(window)
-    mean = arr.mean()
-    std = arr.std() or 1.0
-    z = (arr[-1] - mean) / std
-    log(f"Latest p95={arr[-1]:.3f}, mean={mean:.3f}, std={std:.3f}, z={z:.2f}, threshold={threshold:.2f}")
-    return z > threshold
+        async def tick():
+            await snapshots.maybe_save(engines)
+
+            # NaN/Inf results are already dropped while decoding the response
+            samples = await resolver.fetch()
+            if not samples:
+                log("No latency data available from Prometheus")
+                return
+
+            value = next(iter(samples.values()))
+            started = time.perf_counter()
+            detections = engine.observe({key: value})
+            record_engine(engine, len(detections), time.perf_counter() - started)
+            filled = int(engine.windows.counts[engine.windows.rows[key]])
+            log(f"Collected latency: {value:.3f}s (window size: {filled})")
+
+            if filled < MIN_WINDOW_SIZE:
+                log(f"Building window: {filled}/{MIN_WINDOW_SIZE} samples")
+            for d in detections:
+                log(f"Latest p95={d.value:.3f}, baseline={d.baseline:.3f}, score={d.score:.2f}, "
+                    f"threshold={ANOMALY_THRESHOLD:.2f}")
+                log("Anomaly detected!")
+            for write in tracker.update(engine, detections):
+                writer.submit(write)
+
+        try:
+            await run_fixed_rate(TICK_INTERVAL, tick)
+        finally:
+            snapshots.save(engines)
+
+
+async def run_push_ingest(writer: AnomalyWriter):
+    """Detection fed by OTLP exports; the tick clock only ages series and saves snapshots."""
+    engine = make_engine("p95_latency", capacity=SERIES_CAPACITY)
+    engines = {"p95_latency": engine}
+    # An export only carries the series its sender knows about; absent ones are not quiet
+    tracker = make_tracker("p95_latency", missing_is_quiet=False)
+    receiver = OtlpReceiver(INGEST_METRICS, INGEST_GROUP_BY, 0.95, INGEST_QUEUE_SIZE,
+                            stream_idle=INGEST_STREAM_IDLE)
+    snapshots = Snapshotter(SNAPSHOT_PATH, SNAPSHOT_INTERVAL, SNAPSHOT_MAX_AGE)
+
+    async with PromClient(PROM_URL, PROM_MAX_CONCURRENCY, PROM_TIMEOUT) as prom:
+        await warm_start(snapshots, engines, {"p95_latency": SERIES_QUERY}, prom, TICK_INTERVAL)
+
+    async def consume():
+        async for samples in receiver.batches():
+            started = time.perf_counter()
+            try:
+                detections = engine.observe(samples, advance=False)
+            except Exception as e:
+                log(f"Failed to score OTLP export: {e}")
+                continue
+            record_engine(engine, len(detections), time.perf_counter() - started)
+            for d in detections:
+                log(f"Anomaly detected for p95_latency{series_name(d.key)}: value={d.value:.3f}, "
+                    f"baseline={d.baseline:.3f}, score={d.score:.2f}")
+            for write in tracker.update(engine, detections):
+                writer.submit(write)
+
+    async def tick():
+        evicted = engine.advance_clock()
+        if evicted:
+            log(f"Evicted {len(evicted)} idle p95_latency series")
+        await snapshots.maybe_save(engines)
+
+    await receiver.start(INGEST_PORT)
+    consumer = asyncio.create_task(consume())
+    try:
+        await run_fixed_rate(TICK_INTERVAL, tick)
+    finally:
+        consumer.cancel()
+        await receiver.stop()
+        snapshots.save(engines)
 
 
 # Modify main() function around line 77-102
 def main():
-    conn = get_pg_conn()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    # Make threshold configurable
-    ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "2.5"))  # Lower default
-    MIN_WINDOW_SIZE = int(os.getenv("MIN_WINDOW_SIZE", "3"))  # Lower from 5 to 3
+    # Started first so today's partition normally exists before the first insert
+    partitions = PartitionManager(get_pg_conn, "anomalies", ANOMALY_RETENTION_DAYS, PARTITION_PREMAKE_DAYS,
+                                  PARTITION_MAINTENANCE_INTERVAL)
+    partitions.start()
+    # The writer retries on its own, between checks for shutdown
+    writer = AnomalyWriter(lambda: get_pg_conn(retry=False), WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL,
+                           WRITE_QUEUE_SIZE, SPILL_PATH)
+    writer.start()
 
     # Initial diagnostic check
     log("=" * 60)
@@ -278,11 +489,21 @@ def main():
     log("=" * 60)
     log(f"Prometheus URL: {PROM_URL}")
     log(f"Query: {QUERY}")
+    log(f"Detection mode: {DETECTION_MODE}, ingest mode: {INGEST_MODE}")
+    if SHARD_COUNT > 1:
+        if DETECTION_MODE == "multi":
+            log(f"Shard: {SHARD_INDEX}/{SHARD_COUNT} on label {SHARD_LABEL}")
+        else:
+            log("⚠ SHARD_COUNT is ignored in single mode; every replica watches the same series")
+    if "SIGNALS" in os.environ and DETECTION_MODE != "multi" and INGEST_MODE == "poll":
+        log("⚠ SIGNALS is ignored in single mode; set DETECTION_MODE=multi to watch them")
+    log(f"Detector: {DETECTOR} (overrides: {METRIC_DETECTORS or 'none'}), window={WINDOW_SIZE}, "
+        f"threshold={ANOMALY_THRESHOLD}")
     
     # Check Prometheus connectivity
     try:
         health_url = PROM_URL.replace("/api/v1/query", "/-/healthy")
-        resp = requests.get(health_url, timeout=5)
+        resp = http.get(health_url, timeout=5)
         if resp.status_code == 200:
             log("✓ Prometheus is reachable")
         else:
@@ -301,50 +522,24 @@ def main():
         log("  This is normal if no requests have been made yet.")
         log("  Try: curl http://localhost:8080/checkout")
     
+    start_metrics_server(METRICS_PORT)
     log("=" * 60)
     log("Starting anomaly detection loop...")
     log("=" * 60)
 
-    while True:
-        value = fetch_p95_latency()
-        if value is not None:
-            # Additional validation - skip NaN values
-            import math
-            if math.isnan(value) or math.isinf(value):
-                log(f"Skipping invalid latency value: {value}")
-            else:
-                latency_window.append(value)
-                log(f"Collected latency: {value:.3f}s (window size: {len(latency_window)})")
-                if len(latency_window) > WINDOW_SIZE:
-                    latency_window.pop(0)
-
-            if len(latency_window) >= MIN_WINDOW_SIZE:
-                if detect_anomaly(latency_window, ANOMALY_THRESHOLD):
-                    log("Anomaly detected! Inserting into DB.")
-                    baseline = float(np.mean(latency_window[:-1])) if len(latency_window) > 1 else value
-                    try:
-                        cur.execute(
-                            """
-                            INSERT INTO anomalies (service_name, metric_name, severity, value, baseline, timestamp)
-                            VALUES (%s, %s, %s, %s, %s, NOW())
-                            """,
-                            (
-                                "telemetry-demo-service",
-                                "p95_latency",
-                                "HIGH",
-                                value,
-                                baseline,
-                            ),
-                        )
-                        log(f"Successfully inserted anomaly: value={value:.3f}, baseline={baseline:.3f}")
-                    except Exception as e:
-                        log(f"Failed to insert anomaly: {e}")
-            else:
-                log(f"Building window: {len(latency_window)}/{MIN_WINDOW_SIZE} samples")
+    # docker stop sends SIGTERM; turn it into a normal exit so queued anomalies get flushed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if INGEST_MODE == "push":
+            asyncio.run(run_push_ingest(writer))
+        elif DETECTION_MODE == "multi":
+            asyncio.run(run_multi_series(writer))
         else:
-            log("No latency data available from Prometheus")
-
-        time.sleep(15)
+            asyncio.run(run_single_series(writer))
+    finally:
+        # Partition maintenance holds no data; only the writer's queue is worth waiting for
+        partitions.close(timeout=1.0)
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""
+Partition maintenance for the anomalies table.
+
+`anomalies` is range-partitioned by day on `timestamp` (see
+infra/postgres/init.sql). A background thread creates the partitions for
+today and the next `premake_days` days and drops the ones older than
+`retention_days`, at startup and then every `interval` seconds, so inserts
+and the incident aggregator's recent-window scans only ever touch a few
+small partitions however much history is kept. Dropping a whole partition
+also replaces bulk DELETEs for retention.
+
+Tables created before partitioning (init.sql only runs on a fresh volume)
+stay as they are: maintenance adds the indexes the partitioned schema has
+and enforces retention with batched DELETEs instead.
+
+Replicas running at the same time take turns through an advisory lock.
+"""
+
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable
+
+from util import log
+
+# Arbitrary, but shared by all replicas so only one of them maintains at a time
+LOCK_ID = 0x616E6F6D
+# Rows per retention DELETE on an unpartitioned table, so no statement holds locks for long
+DELETE_BATCH = 10000
+
+
+def partition_name(table: str, day: date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+class PartitionManager:
+    def __init__(self, connect: Callable, table: str = "anomalies", retention_days: int = 30,
+                 premake_days: int = 2, interval: float = 3600.0):
+        """`connect` must block until it returns an autocommit connection (get_pg_conn)."""
+        self.connect = connect
+        self.table = table
+        self.retention_days = retention_days
+        self.premake_days = premake_days
+        self.interval = interval
+        self.name_pattern = re.compile(rf"{re.escape(table)}_p(\d{{8}})")
+        self._indexed = False
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="partition-manager", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _partitions(self, cur) -> dict[date, str]:
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+        """, (self.table,))
+        days = {}
+        for (name,) in cur.fetchall():
+            match = self.name_pattern.fullmatch(name)
+            if match:
+                days[datetime.strptime(match.group(1), "%Y%m%d").date()] = name
+        return days
+
+    def _create(self, cur, day: date):
+        """Create the partition for `day`, moving in rows that already landed in the default partition.
+
+        Attaching a partition fails while the default partition holds rows in
+        its range, which happens if anomalies were written before maintenance
+        first ran.
+        """
+        name = partition_name(self.table, day)
+        bounds = (day, day + timedelta(days=1))
+        cur.execute("BEGIN")
+        try:
+            cur.execute(f"CREATE TABLE {name} (LIKE {self.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cur.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {self.table}_default WHERE timestamp >= %s AND timestamp < %s RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """, bounds)
+            cur.execute(f"ALTER TABLE {self.table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                        bounds)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+    def maintain(self, cur, today: date | None = None) -> tuple[list[str], list[str]]:
+        """Create missing upcoming partitions and drop expired ones; returns (created, dropped)."""
+        # Rows are stored as naive UTC timestamps
+        today = today or datetime.now(timezone.utc).date()
+        existing = self._partitions(cur)
+        created, dropped = [], []
+
+        for offset in range(self.premake_days + 1):
+            day = today + timedelta(days=offset)
+            if day in existing:
+                continue
+            self._create(cur, day)
+            created.append(partition_name(self.table, day))
+
+        cutoff = today - timedelta(days=self.retention_days)
+        for day, name in sorted(existing.items()):
+            if day < cutoff:
+                cur.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped.append(name)
+        return created, dropped
+
+    def maintain_unpartitioned(self, cur, today: date | None = None) -> int:
+        """Index a table created before partitioning and delete expired rows; returns rows deleted."""
+        if not self._indexed:
+            log(f"Table {self.table} is not partitioned, keeping retention with DELETEs")
+            # CONCURRENTLY: the table may be large and must stay writable meanwhile
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.table}_unassigned_idx "
+                        f"ON {self.table} (timestamp) WHERE incident_id IS NULL")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.table}_timestamp_idx "
+                        f"ON {self.table} (timestamp)")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.table}_incident_id_idx "
+                        f"ON {self.table} (incident_id) WHERE incident_id IS NOT NULL")
+            self._indexed = True
+
+        today = today or datetime.now(timezone.utc).date()
+        cutoff = today - timedelta(days=self.retention_days)
+        deleted = 0
+        while not self._stop.is_set():
+            cur.execute(f"""
+                DELETE FROM {self.table} WHERE ctid IN (
+                    SELECT ctid FROM {self.table} WHERE timestamp < %s LIMIT %s
+                )
+            """, (cutoff, DELETE_BATCH))
+            deleted += cur.rowcount
+            if cur.rowcount < DELETE_BATCH:
+                break
+        return deleted
+
+    def _run_once(self):
+        conn = self.connect()
+        created = dropped = deleted = None
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (self.table,))
+                row = cur.fetchone()
+                if row is None:
+                    # init.sql has not run yet
+                    return
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_ID,))
+                if not cur.fetchone()[0]:
+                    return
+                try:
+                    if row[0] == "p":
+                        created, dropped = self.maintain(cur)
+                    else:
+                        deleted = self.maintain_unpartitioned(cur)
+                finally:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
+            if created or dropped:
+                log(f"Partitions of {self.table}: created {created or 'none'}, "
+                    f"dropped {dropped or 'none'} (retention {self.retention_days}d)")
+            if deleted:
+                log(f"Deleted {deleted} rows older than {self.retention_days}d from {self.table}")
+        finally:
+            conn.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._run_once()
+            except Exception as e:
+                log(f"Partition maintenance failed: {e}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,110 @@
+"""
+Async Prometheus HTTP API client.
+
+One pooled aiohttp session (keep-alive) is shared by every query of a tick
+and a semaphore bounds how many are in flight, so a tick with many queries
+takes about as long as its slowest query.
+"""
+
+import asyncio
+import math
+import time
+
+import aiohttp
+import numpy as np
+
+from instrumentation import NAN_SKIPS, QUERY_ERRORS, QUERY_SECONDS
+from series import SeriesKey, series_key
+
+
+class PromQueryError(Exception):
+    pass
+
+
+def unit_scale(query: str) -> float:
+    """Divisor that turns the query's result into seconds."""
+    return 1000.0 if "milliseconds" in query.lower() else 1.0
+
+
+def vector_samples(data: dict, scale: float = 1.0) -> dict[SeriesKey, float]:
+    """Decode an instant-vector response into series key -> value, skipping NaN/Inf."""
+    samples = {}
+    for item in data.get("data", {}).get("result", []):
+        value = float(item["value"][1])
+        if math.isnan(value) or math.isinf(value):
+            NAN_SKIPS.inc()
+            continue
+        samples[series_key(item["metric"])] = value / scale
+    return samples
+
+
+def decode_matrix(responses: list[dict], start: float, step: float, length: int,
+                  scale: float = 1.0) -> tuple[list, np.ndarray]:
+    """Merge query_range responses into (series keys, series x time matrix).
+
+    Missing points, NaN and +/-Inf all become NaN.
+    """
+    rows: dict = {}
+    points = []
+    for data in responses:
+        for item in data["data"]["result"]:
+            row = rows.setdefault(series_key(item["metric"]), len(rows))
+            values = np.array(item["values"], dtype=float)
+            idx = np.rint((values[:, 0] - start) / step).astype(np.int64)
+            keep = (idx >= 0) & (idx < length)
+            points.append((row, idx[keep], values[keep, 1]))
+
+    matrix = np.full((len(rows), length), np.nan)
+    for row, idx, values in points:
+        matrix[row, idx] = values / scale
+    matrix[~np.isfinite(matrix)] = np.nan
+    return list(rows), matrix
+
+
+class PromClient:
+    def __init__(self, query_url: str, max_concurrency: int = 8, timeout: float = 10.0):
+        # PROM_URL points at the instant query endpoint; keep the API root
+        self.base_url = query_url.replace("/api/v1/query", "")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def get(self, path: str, params) -> dict:
+        """GET an API path and return the decoded body, raising on API errors."""
+        endpoint = path.removeprefix("/api/v1/")
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                async with self._session.get(f"{self.base_url}{path}", params=params) as resp:
+                    data = await resp.json(content_type=None)
+            except Exception:
+                QUERY_ERRORS.labels(endpoint).inc()
+                raise
+            finally:
+                QUERY_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        if data.get("status") != "success":
+            QUERY_ERRORS.labels(endpoint).inc()
+            raise PromQueryError(data.get("error", f"HTTP {resp.status}"))
+        return data
+
+    async def query(self, query: str) -> dict:
+        return await self.get("/api/v1/query", {"query": query})
+
+    async def query_range(self, query: str, start: float, end: float, step: float) -> dict:
+        return await self.get("/api/v1/query_range",
+                              {"query": query, "start": start, "end": end, "step": step})
+
+    async def query_vector(self, query: str, scale: float | None = None) -> dict[SeriesKey, float]:
+        """Instant query decoded into samples, converted to seconds (or divided by `scale`)."""
+        return vector_samples(await self.query(query), unit_scale(query) if scale is None else scale)
@@ -0,0 +1,84 @@
+"""
+Client-side histogram quantiles.
+
+Computes histogram_quantile() for every series and every requested
+quantile in one NumPy pass over a (series x bucket) matrix of cumulative
+bucket rates, so Prometheus only has to return the bucket rates once per
+tick instead of evaluating one histogram_quantile query per quantile.
+Follows Prometheus' interpolation rules, including its handling of the
++Inf bucket and non-monotonic buckets.
+"""
+
+import numpy as np
+
+from series import SeriesKey
+
+
+def histogram_quantiles(bounds: np.ndarray, cumulative: np.ndarray, quantiles) -> np.ndarray:
+    """Quantiles of cumulative histograms sharing one bucket layout.
+
+    `bounds` are the ascending upper bounds (the last one +Inf) and
+    `cumulative` is (series x len(bounds)). Returns (series x quantiles);
+    NaN where a series has no observations or the layout lacks a +Inf bucket.
+    """
+    quantiles = np.asarray(quantiles, dtype=float)
+    n, b = cumulative.shape
+    result = np.full((n, len(quantiles)), np.nan)
+    if b < 2 or not np.isinf(bounds[-1]):
+        return result
+
+    # Float rounding in rate() can make buckets decrease slightly; Prometheus flattens those
+    cumulative = np.maximum.accumulate(cumulative, axis=1)
+    total = cumulative[:, -1:]
+    ranks = total * quantiles[None, :]
+
+    # First bucket whose cumulative count reaches the rank
+    idx = (cumulative[:, None, :] < ranks[..., None]).sum(axis=2)
+    idx = np.minimum(idx, b - 1)
+    rows = np.arange(n)[:, None]
+    upper = bounds[idx]
+    lower = np.where(idx > 0, bounds[np.maximum(idx - 1, 0)], 0.0)
+    below = np.where(idx > 0, cumulative[rows, np.maximum(idx - 1, 0)], 0.0)
+    inside = cumulative[rows, idx] - below
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = lower + (upper - lower) * (ranks - below) / inside
+
+    # Rank in the +Inf bucket: the highest finite bound is the best estimate
+    value = np.where(idx == b - 1, bounds[b - 2], value)
+    # First bucket with a non-positive upper bound: no lower bound to interpolate from
+    value = np.where((idx == 0) & (upper <= 0), upper, value)
+    return np.where(total > 0, value, np.nan)
+
+
+def bucket_matrix(samples: dict[SeriesKey, float]) -> tuple[list[SeriesKey], np.ndarray, np.ndarray]:
+    """Cumulative `le` bucket samples -> (series keys without le, bounds, series x bucket matrix).
+
+    Series missing one of the union of bounds carry their previous bucket's count.
+    """
+    groups: dict[SeriesKey, int] = {}
+    rows, les, values = [], [], []
+    for key, value in samples.items():
+        labels = dict(key)
+        le = labels.pop("le", None)
+        if le is None:
+            continue
+        rows.append(groups.setdefault(tuple(sorted(labels.items())), len(groups)))
+        les.append(float(le))
+        values.append(value)
+
+    bounds, cols = np.unique(np.array(les, dtype=float), return_inverse=True)
+    matrix = np.zeros((len(groups), len(bounds)))
+    matrix[np.array(rows, dtype=np.int64), cols] = values
+    return list(groups), bounds, np.maximum.accumulate(matrix, axis=1) if len(bounds) else matrix
+
+
+def quantile_samples(samples: dict[SeriesKey, float], quantiles,
+                     scale: float = 1.0) -> list[dict[SeriesKey, float]]:
+    """Bucket rate samples -> one sample set per quantile, with bounds divided by `scale`."""
+    keys, bounds, cumulative = bucket_matrix(samples)
+    values = histogram_quantiles(bounds / scale, cumulative, quantiles)
+    out = []
+    for column in values.T:
+        present = np.nonzero(~np.isnan(column))[0]
+        out.append({keys[i]: float(column[i]) for i in present})
+    return out
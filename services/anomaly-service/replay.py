@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Offline backfill/replay for anomaly-service.
+
+Pulls a historical range with /api/v1/query_range (split into chunks that
+are fetched concurrently), decodes the matrix straight into a NumPy
+(series x time) array and runs the configured detector over the whole
+history in one vectorized pass. Many thresholds can be evaluated at once
+since scoring does not depend on the threshold.
+
+Works against a live Prometheus or a recorded JSON fixture:
+
+  python replay.py --start 7d --record week.json
+  python replay.py --fixture week.json --thresholds 2,2.5,3,4
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import main
+from detectors import make_detector
+from prom import PromClient, decode_matrix, unit_scale
+from series import series_name
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(text: str) -> float:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw])", text)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid duration: {text}")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_time(text: str, now: float) -> float:
+    """Unix seconds, RFC3339, or a duration meaning 'that long before now'."""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if re.fullmatch(r"\d+(?:\.\d+)?[smhdw]", text):
+        return now - parse_duration(text)
+    return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
+async def fetch_range(query: str, start: float, end: float, step: float,
+                      chunk_points: int) -> list[dict]:
+    """Fetch [start, end] as consecutive non-overlapping chunks, concurrently."""
+    chunk_span = chunk_points * step
+    bounds = []
+    t = start
+    while t <= end:
+        bounds.append((t, min(t + chunk_span - step, end)))
+        t += chunk_span
+
+    async with PromClient(main.PROM_URL, main.PROM_MAX_CONCURRENCY, timeout=60) as prom:
+        return list(await asyncio.gather(*(prom.query_range(query, s, e, step) for s, e in bounds)))
+
+
+def fixture_grid(responses: list[dict], step: float | None) -> tuple[float, float, int]:
+    """Infer (start, step, length) from the timestamps in recorded responses."""
+    stamps = np.unique(np.concatenate([
+        np.array(item["values"], dtype=float)[:, 0]
+        for data in responses for item in data["data"]["result"]
+    ]))
+    if step is None:
+        step = float(np.diff(stamps).min()) if len(stamps) > 1 else 15.0
+    start = float(stamps[0])
+    return start, step, int(round((stamps[-1] - start) / step)) + 1
+
+
+def pack_rows(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Move each row's observed samples to the left, as the live windows see them.
+
+    Returns the packed matrix and, for every packed cell, its original column.
+    """
+    order = np.argsort(np.isnan(matrix), axis=1, kind="stable")
+    return np.take_along_axis(matrix, order, axis=1), order
+
+
+def evaluate(matrix: np.ndarray, detector: str, window_size: int, min_samples: int,
+             alpha: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Score every sample of every series; returns (scores, baselines, ready, columns)."""
+    packed, columns = pack_rows(matrix)
+    params = {"alpha": alpha} if detector == "ewma" else {}
+    scores, baselines = make_detector(detector, window_size, len(packed), **params).score_history(packed)
+
+    # Same warm-up rule as DetectionEngine: enough prior samples in the window
+    prior = np.minimum(np.arange(packed.shape[1]), window_size)
+    ready = (prior >= 2) & (prior + 1 >= min_samples) & ~np.isnan(packed)
+    return scores, baselines, ready, columns
+
+
+def sweep(scores: np.ndarray, ready: np.ndarray, thresholds: list[float]) -> list[dict]:
+    summary = []
+    for threshold in thresholds:
+        hits = ready & (scores > threshold)
+        summary.append({
+            "threshold": threshold,
+            "anomalies": int(hits.sum()),
+            "series": int(hits.any(axis=1).sum()),
+        })
+    return summary
+
+
+def anomaly_rows(keys, packed_values, scores, baselines, hits, columns, start, step) -> list[dict]:
+    rows = []
+    for r, c in zip(*np.nonzero(hits)):
+        ts = start + columns[r, c] * step
+        rows.append({
+            "timestamp": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+            "series": series_name(keys[r]),
+            "service_name": dict(keys[r]).get("service_name", ""),
+            "value": float(packed_values[r, c]),
+            "baseline": float(baselines[r, c]),
+            "score": float(scores[r, c]),
+        })
+    rows.sort(key=lambda row: row["timestamp"])
+    return rows
+
+
+def write_output(path: str, rows: list[dict]):
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["timestamp", "series", "service_name",
+                                                   "value", "baseline", "score"])
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(
+        description="Replay historical Prometheus data through the anomaly detector",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Replay the last day and write the anomalies that would have been raised
+  python replay.py --start 1d --output anomalies.csv
+
+  # Record a week of data once, then tune offline
+  python replay.py --start 7d --record week.json
+  python replay.py --fixture week.json --detector mad --thresholds 2,2.5,3,3.5,4
+        """
+    )
+    parser.add_argument("--query", default=main.SERIES_QUERY, help="PromQL to replay (default: SERIES_QUERY)")
+    parser.add_argument("--signal",
+                        help="Replay a multi-mode signal (pNN_latency, error_ratio, request_rate) "
+                             "instead of --query")
+    parser.add_argument("--start", default="1h", help="Start: unix, RFC3339 or duration ago (default: 1h)")
+    parser.add_argument("--end", default=None, help="End: unix or RFC3339 (default: now)")
+    parser.add_argument("--step", type=parse_duration, default=None,
+                        help="Resolution, e.g. 15s (default: TICK_INTERVAL, or inferred from a fixture)")
+    parser.add_argument("--chunk-points", type=int, default=10000,
+                        help="Points per series per query_range request (default: 10000)")
+    parser.add_argument("--fixture", help="Read recorded query_range responses instead of Prometheus")
+    parser.add_argument("--record", help="Save the fetched responses as a fixture")
+    parser.add_argument("--detector", default=main.DETECTOR, help=f"Detector (default: {main.DETECTOR})")
+    parser.add_argument("--window", type=int, default=main.WINDOW_SIZE,
+                        help=f"Window size (default: {main.WINDOW_SIZE})")
+    parser.add_argument("--threshold", type=float, default=main.ANOMALY_THRESHOLD,
+                        help=f"Threshold for the anomaly listing (default: {main.ANOMALY_THRESHOLD})")
+    parser.add_argument("--thresholds", default="",
+                        help="Comma-separated thresholds to sweep in the same pass")
+    parser.add_argument("--output", help="Write anomalies at --threshold to a .json or .csv file")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    query, scale = args.query, None
+    if args.signal:
+        # Signal queries convert units in PromQL
+        query, scale = main.signal_set(main.SIGNAL_METRIC, [args.signal], False)[args.signal], 1.0
+    if args.fixture:
+        with open(args.fixture) as f:
+            fixture = json.load(f)
+        if "responses" in fixture:
+            # Written by --record
+            query, responses = fixture["query"], fixture["responses"]
+            scale = fixture.get("scale")
+            start, step, length = fixture["start"], fixture["step"], fixture["length"]
+        else:
+            # A raw query_range response (or a list of them) saved from the API
+            responses = fixture if isinstance(fixture, list) else [fixture]
+            start, step, length = fixture_grid(responses, args.step)
+    else:
+        now = time.time()
+        step = args.step or main.TICK_INTERVAL
+        start = parse_time(args.start, now)
+        end = parse_time(args.end, now) if args.end else now
+        length = int((end - start) // step) + 1
+        responses = asyncio.run(fetch_range(query, start, start + (length - 1) * step,
+                                            step, args.chunk_points))
+        if args.record:
+            with open(args.record, "w") as f:
+                json.dump({"query": query, "scale": scale, "start": start, "step": step,
+                           "length": length, "responses": responses}, f)
+    fetched = time.perf_counter()
+
+    keys, matrix = decode_matrix(responses, start, step, length,
+                                 unit_scale(query) if scale is None else scale)
+    if not keys:
+        print("No series in range")
+        sys.exit(1)
+
+    scores, baselines, ready, columns = evaluate(matrix, args.detector, args.window,
+                                                 main.MIN_WINDOW_SIZE, main.EWMA_ALPHA)
+    packed_values = np.take_along_axis(matrix, columns, axis=1)
+    thresholds = sorted({args.threshold, *(float(t) for t in args.thresholds.split(",") if t)})
+    summary = sweep(scores, ready, thresholds)
+    hits = ready & (scores > args.threshold)
+    rows = anomaly_rows(keys, packed_values, scores, baselines, hits, columns, start, step)
+    done = time.perf_counter()
+
+    print(f"Replayed {len(keys)} series x {length} steps ({step:g}s) with detector={args.detector}, "
+          f"window={args.window}")
+    print(f"Fetch/load: {fetched - began:.2f}s, evaluate: {done - fetched:.2f}s")
+    print(f"\n{'threshold':>10} {'anomalies':>10} {'series':>8}")
+    for item in summary:
+        print(f"{item['threshold']:>10g} {item['anomalies']:>10} {item['series']:>8}")
+
+    if args.output:
+        write_output(args.output, rows)
+        print(f"\nWrote {len(rows)} anomalies to {args.output}")
+    else:
+        print(f"\nAnomalies at threshold {args.threshold:g} (first 20 of {len(rows)}):")
+        for row in rows[:20]:
+            print(f"  {row['timestamp']} {row['series']} value={row['value']:.3f} "
+                  f"baseline={row['baseline']:.3f} score={row['score']:.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
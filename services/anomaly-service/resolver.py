@@ -0,0 +1,133 @@
+"""
+Query resolution cache.
+
+Remembers which query variant (and therefore which unit) actually returns
+data, so a tick costs exactly one Prometheus round-trip. When the active
+query fails or comes back empty, or its TTL runs out, a single background
+probe re-checks the candidates; metric names that do not exist are kept in
+a negative cache so they are not probed again until it expires.
+"""
+
+import asyncio
+import re
+import time
+from typing import Callable
+
+from instrumentation import FALLBACK_QUERIES
+from prom import PromClient
+from series import SeriesKey
+from util import log
+
+
+class QueryResolver:
+    def __init__(self, prom: PromClient, primary: str, alternatives: list[str] = (),
+                 template: str | Callable[[str], str] | None = None, patterns: list[str] = (),
+                 ttl: float = 300.0, negative_ttl: float = 600.0, retry_interval: float = 60.0,
+                 rewrite: Callable[[str], str | None] | None = None, name: str = "",
+                 scale: float | None = None):
+        """
+        `alternatives` are fixed fallback queries tried in order after `primary`;
+        `template` (with a `{metric}` placeholder, or a function of the metric
+        name) turns each discovered metric in `patterns` into one more candidate. `rewrite` is applied to a query
+        right before it is sent (e.g. the shard filter); returning None means
+        there is nothing to fetch. `name` labels the metrics of this resolver;
+        `scale` overrides the unit guessed from the query text.
+        """
+        self.prom = prom
+        self.primary = primary
+        self.alternatives = list(alternatives)
+        self.template = template
+        self.patterns = list(patterns)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.retry_interval = retry_interval
+        self.rewrite = rewrite or (lambda query: query)
+        self.name = name
+        self.scale = scale
+
+        self.active = primary
+        self.healthy = True
+        self.next_probe_at = time.monotonic() + ttl
+        self.missing: dict[str, float] = {}
+        self._probe: asyncio.Task | None = None
+
+    async def fetch(self) -> dict[SeriesKey, float]:
+        """Run the active query; schedule a background re-probe if it has gone bad."""
+        query = self.rewrite(self.active)
+        if query is None:
+            return {}
+        if self.active != self.primary:
+            FALLBACK_QUERIES.labels(self.name).inc()
+        try:
+            samples = await self.prom.query_vector(query, self.scale)
+        except Exception as e:
+            log(f"Error querying Prometheus: {e!r}")
+            log(f"Query used: {query}")
+            samples = {}
+
+        now = time.monotonic()
+        if not samples and self.healthy:
+            log(f"No data for query: {self.active}; re-resolving in the background")
+            self.healthy = False
+            self._start_probe()
+        elif now >= self.next_probe_at:
+            self._start_probe()
+        return samples
+
+    def _start_probe(self):
+        if self._probe is None or self._probe.done():
+            self.next_probe_at = time.monotonic() + self.retry_interval
+            self._probe = asyncio.create_task(self._resolve())
+
+    def _is_missing(self, query: str, now: float) -> bool:
+        return any(metric in query for metric, until in self.missing.items() if until > now)
+
+    async def _discovered(self, now: float) -> list[str]:
+        """Candidate queries for the known metric names that exist, in one round-trip."""
+        patterns = [p for p in self.patterns if self.missing.get(p, 0) <= now]
+        if not self.template or not patterns:
+            return []
+        selector = "|".join(re.escape(p) for p in patterns)
+        data = await self.prom.query(f'count by (__name__) ({{__name__=~"{selector}", le!=""}})')
+        present = {item["metric"].get("__name__") for item in data["data"]["result"]}
+        for pattern in patterns:
+            if pattern in present:
+                self.missing.pop(pattern, None)
+            else:
+                self.missing[pattern] = now + self.negative_ttl
+        build = self.template if callable(self.template) else lambda p: self.template.format(metric=p)
+        return [build(p) for p in patterns if p in present]
+
+    async def _resolve(self):
+        now = time.monotonic()
+        try:
+            discovered = await self._discovered(now)
+        except Exception as e:
+            log(f"Metric discovery failed: {e!r}")
+            discovered = []
+
+        candidates = []
+        for query in [self.primary, *self.alternatives, *discovered]:
+            if query not in candidates and not self._is_missing(query, now):
+                candidates.append(query)
+
+        async def probe(query):
+            query = self.rewrite(query)
+            return await self.prom.query_vector(query, self.scale) if query is not None else {}
+
+        results = await asyncio.gather(*(probe(q) for q in candidates), return_exceptions=True)
+        for query, samples in zip(candidates, results):
+            if isinstance(samples, dict) and samples:
+                if query != self.active:
+                    log(f"Resolved query: {query}")
+                self.active = query
+                self.healthy = True
+                self.next_probe_at = time.monotonic() + self.ttl
+                return
+
+        log("No data found with any query variant. Possible issues:")
+        log("  1. No requests have been made to telemetry-demo-service yet")
+        log("  2. Metric name doesn't match (check Prometheus UI at http://localhost:9090)")
+        log("  3. Time range issue - try increasing [1m] to [5m] or [10m]")
+        log("  4. Check Prometheus targets: http://localhost:9090/targets")
+        self.next_probe_at = time.monotonic() + self.retry_interval
@@ -0,0 +1,39 @@
+"""
+Fixed-rate tick scheduling for the detection loop.
+
+Ticks are anchored to a monotonic clock (start + n * interval) instead of
+sleeping a fixed amount after the work, so query time does not stretch the
+period. A tick that overruns skips the slots it missed rather than queueing
+them up behind it.
+"""
+
+import asyncio
+from typing import Awaitable, Callable
+
+from instrumentation import TICK_SECONDS, TICKS_SKIPPED
+from util import log
+
+
+async def run_fixed_rate(interval: float, tick: Callable[[], Awaitable[None]]):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    n = 0
+
+    while True:
+        began = loop.time()
+        try:
+            await tick()
+        except Exception as e:
+            log(f"Tick failed: {e}")
+
+        n += 1
+        now = loop.time()
+        TICK_SECONDS.observe(now - began)
+        next_at = start + n * interval
+        if now > next_at:
+            missed = int((now - next_at) // interval) + 1
+            n += missed
+            TICKS_SKIPPED.inc(missed)
+            next_at = start + n * interval
+            log(f"Tick took {now - began:.2f}s (interval {interval:g}s), skipping {missed} tick(s)")
+        await asyncio.sleep(next_at - now)
@@ -0,0 +1,138 @@
+"""
+Per-series sliding windows for multi-series anomaly detection.
+
+All series share one preallocated (series x window) NumPy ring buffer so a
+tick is a single fancy-indexed write and detection is a single vectorized
+pass, regardless of how many label sets Prometheus returns.
+"""
+
+import numpy as np
+
+# A series is identified by its sorted label pairs (minus __name__)
+SeriesKey = tuple[tuple[str, str], ...]
+
+
+def series_key(metric: dict) -> SeriesKey:
+    """Build a hashable key from a Prometheus result's `metric` labels."""
+    return tuple(sorted((k, v) for k, v in metric.items() if k != "__name__"))
+
+
+def series_name(key: SeriesKey) -> str:
+    """Human readable label set, e.g. {service_name="a",uri="/checkout"}."""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+class SeriesWindows:
+    """Ring buffer of the last `window_size` samples for a dynamic set of series.
+
+    Rows are handed out as new label sets appear and returned to a free list
+    once a series has not been seen for `max_idle_ticks` ticks. The buffer
+    doubles in place when it runs out of rows.
+    """
+
+    def __init__(self, window_size: int, capacity: int = 1024, max_idle_ticks: int = 20):
+        self.window_size = window_size
+        self.max_idle_ticks = max_idle_ticks
+        self.tick = 0
+
+        self.values = np.full((capacity, window_size), np.nan)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.heads = np.zeros(capacity, dtype=np.int64)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.occupied = np.zeros(capacity, dtype=bool)
+
+        self.rows: dict[SeriesKey, int] = {}
+        self.keys: list[SeriesKey | None] = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def capacity(self) -> int:
+        return self.values.shape[0]
+
+    def _grow(self):
+        old = self.capacity
+        new = old * 2
+        values = np.full((new, self.window_size), np.nan)
+        values[:old] = self.values
+        self.values = values
+        self.counts = np.concatenate([self.counts, np.zeros(old, dtype=np.int64)])
+        self.heads = np.concatenate([self.heads, np.zeros(old, dtype=np.int64)])
+        self.last_seen = np.concatenate([self.last_seen, np.zeros(old, dtype=np.int64)])
+        self.occupied = np.concatenate([self.occupied, np.zeros(old, dtype=bool)])
+        self.keys.extend([None] * old)
+        self._free.extend(range(new - 1, old - 1, -1))
+
+    def _row_for(self, key: SeriesKey) -> int:
+        row = self.rows.get(key)
+        if row is None:
+            if not self._free:
+                self._grow()
+            row = self._free.pop()
+            self.rows[key] = row
+            self.keys[row] = key
+            self.occupied[row] = True
+        return row
+
+    def assign(self, keys) -> np.ndarray:
+        """Map series keys to buffer rows, allocating rows for new series."""
+        keys = list(keys)
+        return np.fromiter((self._row_for(k) for k in keys), dtype=np.int64, count=len(keys))
+
+    def append(self, rows: np.ndarray, values: np.ndarray, advance: bool = True) -> np.ndarray:
+        """Write one value per row and return the samples that fell out of the window.
+
+        Rows whose window was not yet full evict NaN. `advance=False` writes
+        without moving the idle clock, for backfilling history.
+        """
+        if advance:
+            self.tick += 1
+        heads = self.heads[rows]
+        evicted = np.where(self.counts[rows] == self.window_size, self.values[rows, heads], np.nan)
+        self.values[rows, heads] = values
+        self.heads[rows] = (heads + 1) % self.window_size
+        self.counts[rows] = np.minimum(self.counts[rows] + 1, self.window_size)
+        self.last_seen[rows] = self.tick
+        return evicted
+
+    def snapshot(self) -> tuple[list[SeriesKey], np.ndarray, np.ndarray, np.ndarray]:
+        """Compact copy of the occupied rows: (keys, values, counts, heads)."""
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        return list(self.rows), self.values[rows], self.counts[rows], self.heads[rows]
+
+    def load(self, keys: list[SeriesKey], values: np.ndarray, counts: np.ndarray,
+             heads: np.ndarray) -> np.ndarray:
+        """Restore rows from snapshot() output; returns the rows they landed in."""
+        rows = self.assign(keys)
+        self.values[rows] = values
+        self.counts[rows] = counts
+        self.heads[rows] = heads
+        self.last_seen[rows] = self.tick
+        return rows
+
+    def _release(self, rows: np.ndarray) -> list[SeriesKey]:
+        released = []
+        for row in rows:
+            key = self.keys[row]
+            del self.rows[key]
+            self.keys[row] = None
+            self._free.append(int(row))
+            released.append(key)
+        if len(rows):
+            self.values[rows] = np.nan
+            self.counts[rows] = 0
+            self.heads[rows] = 0
+            self.occupied[rows] = False
+        return released
+
+    def evict_idle(self) -> list[SeriesKey]:
+        """Free rows of series that disappeared from the query result."""
+        idle = self.occupied & (self.tick - self.last_seen > self.max_idle_ticks)
+        return self._release(np.nonzero(idle)[0])
+
+    def remove(self, keys) -> list[SeriesKey]:
+        """Free the rows of the given series; unknown keys are ignored."""
+        rows = np.fromiter((self.rows[k] for k in keys if k in self.rows), dtype=np.int64)
+        return self._release(rows)
@@ -0,0 +1,126 @@
+"""
+Horizontal sharding of series across anomaly-service replicas.
+
+Series are assigned to replicas by rendezvous (highest random weight)
+hashing on the value of one label (SHARD_LABEL, service_name by default):
+every replica scores each value against every replica index and owns the
+values it wins. Ownership is stable and needs no coordination, and going
+from N to N+1 replicas only moves the ~1/(N+1) of values the new replica
+wins; the rest keep their windows.
+
+Each replica pushes its share into PromQL as a `label=~"a|b|..."` matcher
+on every range selector, so it only pulls (and Prometheus only evaluates)
+its own series. The set of label values is re-read from the label values
+API every refresh interval; a value that first appears in between is
+picked up at the next refresh.
+"""
+
+import hashlib
+import re
+import time
+
+from prom import PromClient
+from series import SeriesKey
+from util import log
+
+# A metric name followed by an optional {matchers} block and a [range]
+RANGE_SELECTOR = re.compile(r"(?<![\w:])([a-zA-Z_:][\w:]*)\s*(?:\{([^}]*)\})?\s*(?=\[)")
+RE2_SPECIAL = re.compile(r"([\\.+*?()|\[\]{}^$])")
+
+
+def shard_weight(index: int, value: str) -> int:
+    digest = hashlib.blake2b(f"{index}\0{value}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_owner(value: str, count: int) -> int:
+    """Replica index that owns a label value."""
+    return max(range(count), key=lambda index: shard_weight(index, value))
+
+
+def metric_names(queries) -> list[str]:
+    """Metric names used in range selectors of the given queries."""
+    names = []
+    for query in queries:
+        for match in RANGE_SELECTOR.finditer(query):
+            if match.group(1) not in names:
+                names.append(match.group(1))
+    return names
+
+
+def value_regex(values) -> str:
+    """RE2 alternation matching exactly `values`, quoted for a PromQL string.
+
+    The empty value matches series that do not have the label at all.
+    """
+    pattern = "|".join(RE2_SPECIAL.sub(r"\\\1", v) for v in sorted(values))
+    return pattern.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def add_matcher(query: str, matcher: str) -> str:
+    """Add a label matcher to every range selector in a query."""
+    def rewrite(match):
+        existing = (match.group(2) or "").strip().rstrip(",")
+        return f"{match.group(1)}{{{existing + ', ' if existing else ''}{matcher}}}"
+    return RANGE_SELECTOR.sub(rewrite, query)
+
+
+class ShardAssignment:
+    def __init__(self, prom: PromClient, index: int, count: int, label: str = "service_name",
+                 metrics: list[str] = (), refresh_interval: float = 60.0):
+        """`metrics` restricts label value discovery to the series we actually query."""
+        if not 0 <= index < count:
+            raise ValueError(f"SHARD_INDEX must be in [0, {count}), got {index}")
+        self.prom = prom
+        self.index = index
+        self.count = count
+        self.label = label
+        self.metrics = list(dict.fromkeys(metrics))
+        self.refresh_interval = refresh_interval
+
+        self.owned: set[str] = set()
+        self.next_refresh_at = 0.0
+
+    def __str__(self) -> str:
+        return f"shard {self.index}/{self.count} on {self.label}"
+
+    def owns(self, value: str) -> bool:
+        return shard_owner(value, self.count) == self.index
+
+    def owns_key(self, key: SeriesKey) -> bool:
+        return dict(key).get(self.label, "") in self.owned
+
+    def due(self) -> bool:
+        return time.monotonic() >= self.next_refresh_at
+
+    async def refresh(self) -> tuple[set[str], set[str]]:
+        """Re-read the label values and recompute ownership; returns (added, removed).
+
+        On failure the previous assignment is kept.
+        """
+        self.next_refresh_at = time.monotonic() + self.refresh_interval
+        params = {}
+        if self.metrics:
+            names = "|".join(re.escape(m) for m in self.metrics)
+            params["match[]"] = f'{{__name__=~"{names}"}}'
+        try:
+            data = await self.prom.get(f"/api/v1/label/{self.label}/values", params)
+        except Exception as e:
+            log(f"Could not refresh {self} assignment: {e!r}")
+            return set(), set()
+
+        # "" stands for series without the label, so exactly one replica keeps them
+        owned = {v for v in ["", *data["data"]] if self.owns(v)}
+        added, removed = owned - self.owned, self.owned - owned
+        self.owned = owned
+        if added or removed:
+            log(f"{self}: owns {len(owned)} of {len(data['data']) + 1} values "
+                f"(+{len(added)}, -{len(removed)})")
+        return added, removed
+
+    def rewrite(self, query: str, values=None) -> str | None:
+        """Restrict a query to the owned values (or a subset); None if there are none."""
+        values = self.owned if values is None else values
+        if not values:
+            return None
+        return add_matcher(query, f'{self.label}=~"{value_regex(values)}"')
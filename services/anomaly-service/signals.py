@@ -0,0 +1,96 @@
+"""
+Multi-signal detection from one Prometheus round-trip.
+
+Each signal (latency quantiles, error ratio, request rate) is a grouped
+PromQL expression over the same HTTP server histogram. They are tagged with
+a synthetic `signal` label via label_replace() and joined with `or`, so one
+instant query returns every signal for every series; the result is then
+split back into one sample set per signal, each with its own detector.
+
+Latency signals are named pNN_latency (p50_latency, p99.9_latency, ...).
+With client-side quantiles they are all served by a single bucket-rate
+subquery and computed locally (see quantiles.py) instead of one
+histogram_quantile per signal.
+
+Values are converted to their final unit inside PromQL (latency in
+seconds, error ratio in 0..1, request rate in req/s), so signal results
+must be decoded with a scale of 1; only raw bucket bounds still carry the
+metric's unit.
+"""
+
+import re
+
+from prom import unit_scale
+from quantiles import quantile_samples
+from series import SeriesKey
+
+SIGNAL_LABEL = "signal"
+BUCKETS_SIGNAL = "latency_buckets"
+LATENCY_SIGNAL = re.compile(r"p(\d+(?:\.\d+)?)_latency")
+
+
+def signal_quantile(name: str) -> float | None:
+    """0.95 for p95_latency; None for signals that are not latency quantiles."""
+    match = LATENCY_SIGNAL.fullmatch(name)
+    return float(match.group(1)) / 100 if match else None
+
+
+def signal_queries(bucket_metric: str, names, group_by: str = "service_name, uri",
+                   error_matcher: str = 'status=~"5.."', client_quantiles: bool = False) -> dict[str, str]:
+    """PromQL for the named signals, built on one `*_bucket` histogram metric.
+
+    With `client_quantiles` the latency signals are replaced by one
+    BUCKETS_SIGNAL query returning the raw bucket rates.
+    """
+    count_metric = bucket_metric.removesuffix("_bucket") + "_count"
+    scale = unit_scale(bucket_metric)
+    requests = f"sum(rate({count_metric}[5m])) by ({group_by})"
+    # `or ... * 0` keeps series that had no errors at all at a ratio of 0 instead of dropping them
+    errors = (f"(sum(rate({count_metric}{{{error_matcher}}}[5m])) by ({group_by})"
+              f" or {requests} * 0)")
+    fixed = {"error_ratio": f"{errors} / {requests}", "request_rate": requests}
+
+    queries = {}
+    for name in names:
+        quantile = signal_quantile(name)
+        if quantile is None:
+            if name not in fixed:
+                raise ValueError(f"Unknown signal '{name}', expected pNN_latency, "
+                                 f"{', '.join(fixed)}")
+            queries[name] = fixed[name]
+        elif client_quantiles:
+            queries[BUCKETS_SIGNAL] = f"sum(rate({bucket_metric}[5m])) by (le, {group_by})"
+        else:
+            latency = (f"histogram_quantile({quantile:g}, "
+                       f"sum(rate({bucket_metric}[5m])) by (le, {group_by}))")
+            queries[name] = f"{latency} / {scale:g}" if scale != 1 else latency
+    return queries
+
+
+def combined_query(queries: dict[str, str]) -> str:
+    """One query returning all signals, each tagged with its name in the `signal` label."""
+    return " or ".join(
+        f'label_replace({query}, "{SIGNAL_LABEL}", "{name}", "", "")' for name, query in queries.items()
+    )
+
+
+def split_signals(samples: dict[SeriesKey, float], names,
+                  bucket_scale: float = 1.0) -> dict[str, dict[SeriesKey, float]]:
+    """Demultiplex a combined result by the `signal` label (which is dropped from the keys).
+
+    Bucket rates, if present, are turned into the latency signals among
+    `names`, with bounds divided by `bucket_scale`.
+    """
+    split = {name: {} for name in [*names, BUCKETS_SIGNAL]}
+    for key, value in samples.items():
+        labels = dict(key)
+        name = labels.pop(SIGNAL_LABEL, None)
+        if name in split:
+            split[name][tuple(sorted(labels.items()))] = value
+
+    buckets = split.pop(BUCKETS_SIGNAL)
+    if buckets:
+        latency = [name for name in names if signal_quantile(name) is not None]
+        computed = quantile_samples(buckets, [signal_quantile(n) for n in latency], bucket_scale)
+        split.update(zip(latency, computed))
+    return split
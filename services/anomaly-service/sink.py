@@ -0,0 +1,326 @@
+"""
+Buffered anomaly writer.
+
+Detections are queued in memory and a background thread writes them to
+Postgres in batches (execute_values), flushing when a batch fills up or the
+flush interval passes. Besides new rows (AnomalyRecord), the queue carries
+updates to the rows of ongoing anomaly episodes (EpisodeUpdate). If the
+queue is full or a write fails, records are appended to a local spill
+file, which is replayed once the connection is re-established. Until then
+new records are spilled too, and a replay applies inserts before updates,
+so an episode update never lands ahead of the row it updates.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+import psycopg2.extras
+
+from instrumentation import ANOMALIES_WRITTEN, DB_ERRORS, FLUSH_SECONDS, INSERT_FAILURES, WRITE_QUEUE_DEPTH
+from util import log
+
+INSERT_SQL = """
+    INSERT INTO anomalies (service_name, metric_name, severity, value, baseline, timestamp,
+                           episode_id, peak_value)
+    VALUES %s
+"""
+# started_at matches the row's timestamp, which lets Postgres go straight to the right rows
+UPDATE_SQL = """
+    UPDATE anomalies AS a
+    SET peak_value = v.peak_value, severity = v.severity,
+        ended_at = v.ended_at, duration_seconds = v.duration_seconds
+    FROM (VALUES %s) AS v(episode_id, started_at, peak_value, severity, ended_at, duration_seconds)
+    WHERE a.episode_id = v.episode_id AND a.timestamp = v.started_at
+"""
+UPDATE_TEMPLATE = "(%s, %s::timestamp, %s::double precision, %s, %s::timestamp, %s::double precision)"
+# Columns added to anomalies after its first release. init.sql only runs on a fresh
+# volume, so the writer adds them to existing databases before its first write.
+ADDED_COLUMNS = (
+    ("episode_id", "TEXT"),
+    ("peak_value", "DOUBLE PRECISION"),
+    ("ended_at", "TIMESTAMP"),
+    ("duration_seconds", "DOUBLE PRECISION"),
+)
+
+
+@dataclass
+class AnomalyRecord:
+    service_name: str
+    metric_name: str
+    severity: str
+    value: float
+    baseline: float
+    # Stamped at detection time so queueing does not shift it
+    timestamp: datetime = None
+    episode_id: str | None = None
+    peak_value: float | None = None
+
+    def __post_init__(self):
+        if self.timestamp is None:
+            self.timestamp = datetime.now(timezone.utc)
+
+    def row(self) -> tuple:
+        return (self.service_name, self.metric_name, self.severity,
+                self.value, self.baseline, self.timestamp, self.episode_id, self.peak_value)
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["timestamp"] = self.timestamp.isoformat()
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, line: str) -> "AnomalyRecord":
+        data = json.loads(line)
+        data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+        return cls(**data)
+
+
+@dataclass
+class EpisodeUpdate:
+    """New state of the row an episode opened with."""
+    episode_id: str
+    started_at: datetime
+    peak_value: float
+    severity: str
+    ended_at: datetime | None = None
+    duration_seconds: float | None = None
+
+    def row(self) -> tuple:
+        return (self.episode_id, self.started_at, self.peak_value, self.severity,
+                self.ended_at, self.duration_seconds)
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["started_at"] = self.started_at.isoformat()
+        data["ended_at"] = self.ended_at.isoformat() if self.ended_at else None
+        return json.dumps({"op": "update", **data})
+
+    @classmethod
+    def from_json(cls, line: str) -> "EpisodeUpdate":
+        data = json.loads(line)
+        del data["op"]
+        data["started_at"] = datetime.fromisoformat(data["started_at"])
+        if data["ended_at"]:
+            data["ended_at"] = datetime.fromisoformat(data["ended_at"])
+        return cls(**data)
+
+
+Write = AnomalyRecord | EpisodeUpdate
+
+
+def ensure_schema(conn):
+    """Add the columns this writer needs to an anomalies table created by an older init.sql."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'anomalies'
+        """)
+        existing = {name for (name,) in cur.fetchall()}
+        # No table at all: init.sql has not run yet and will create it complete
+        missing = [(name, kind) for name, kind in ADDED_COLUMNS if existing and name not in existing]
+        if not missing:
+            return
+        for name, kind in missing:
+            cur.execute(f"ALTER TABLE anomalies ADD COLUMN IF NOT EXISTS {name} {kind}")
+        cur.execute("CREATE INDEX IF NOT EXISTS anomalies_episode_id_idx ON anomalies (episode_id)")
+    log(f"Added columns to anomalies: {', '.join(name for name, _ in missing)}")
+
+
+def parse_spilled(line: str) -> Write:
+    return EpisodeUpdate.from_json(line) if '"op": "update"' in line else AnomalyRecord.from_json(line)
+
+
+class AnomalyWriter:
+    def __init__(self, connect: Callable, batch_size: int = 500, flush_interval: float = 1.0,
+                 max_queue: int = 10000, spill_path: str = "anomalies.spill.jsonl"):
+        """`connect` returns an autocommit connection or raises; failed attempts are retried here.
+
+        It must not block for long (get_pg_conn(retry=False)): while it does,
+        close() cannot tell whether the batch in hand will still be written.
+        """
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+
+        self.queue: queue.Queue[Write] = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="anomaly-writer", daemon=True)
+        self._conn = None
+        self._in_flight: list[Write] = []
+        self._overflowing = False
+
+    def start(self):
+        WRITE_QUEUE_DEPTH.set_function(self.queue.qsize)
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        """Stop accepting work, flush what is queued and spill anything left."""
+        self._stop.set()
+        self._thread.join(timeout)
+        # Still stuck reconnecting: the batch it holds would be lost on exit
+        leftover = list(self._in_flight) if self._thread.is_alive() else []
+        while True:
+            try:
+                leftover.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self._spill(leftover)
+            log(f"Spilled {len(leftover)} unwritten anomalies to {self.spill_path}")
+
+    def submit(self, record: Write):
+        """Queue a record without blocking the detection loop.
+
+        Once the queue overflows, everything goes to the spill file until it
+        has been replayed: a newer record (an episode's update) written from
+        the queue before an older spilled one (its insert) would be lost.
+        """
+        with self._spill_lock:
+            if self._overflowing:
+                self._append_spill([record])
+                return
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                log(f"Write queue full ({self.queue.maxsize}), spilling to {self.spill_path}")
+                self._overflowing = True
+                self._append_spill([record])
+
+    def _spill(self, records: list[Write]):
+        with self._spill_lock:
+            self._append_spill(records)
+
+    def _spill_backlog(self, batch: list[Write]) -> int:
+        """Spill a failed batch and everything queued behind it, in order, and keep spilling.
+
+        The replay then sees all pending records together, so an update is
+        never applied ahead of the insert it belongs to.
+        """
+        with self._spill_lock:
+            records = list(batch)
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._append_spill(records)
+            self._overflowing = True
+        return len(records)
+
+    def _append_spill(self, records: list[Write]):
+        with open(self.spill_path, "a") as f:
+            f.writelines(r.to_json() + "\n" for r in records)
+
+    def _take_batch(self) -> list[Write]:
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, records: list[Write]):
+        inserts = [r.row() for r in records if isinstance(r, AnomalyRecord)]
+        # Inserts go first so an episode opened and updated within one batch finds its row;
+        # only the latest state of each episode matters
+        updates = {r.episode_id: r.row() for r in records if isinstance(r, EpisodeUpdate)}
+        with FLUSH_SECONDS.time():
+            with self._conn.cursor() as cur:
+                # One transaction: a failed update must not leave the inserts committed,
+                # or spilling and replaying the batch would insert them twice
+                cur.execute("BEGIN")
+                try:
+                    if inserts:
+                        psycopg2.extras.execute_values(cur, INSERT_SQL, inserts, page_size=self.batch_size)
+                    if updates:
+                        psycopg2.extras.execute_values(cur, UPDATE_SQL, list(updates.values()),
+                                                       template=UPDATE_TEMPLATE, page_size=self.batch_size)
+                    cur.execute("COMMIT")
+                except Exception:
+                    cur.execute("ROLLBACK")
+                    raise
+        ANOMALIES_WRITTEN.inc(len(inserts))
+
+    def _ensure_connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+            ensure_schema(self._conn)
+            self._replay_spill()
+
+    def _drop_connection(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _replay_spill(self):
+        """Write back records spilled while the database was unavailable."""
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+
+        with open(replay_path) as f:
+            records = [parse_spilled(line) for line in f if line.strip()]
+        # Inserts first (stable), so no update is applied before the row it updates exists
+        records.sort(key=lambda r: isinstance(r, EpisodeUpdate))
+        written = 0
+        try:
+            for i in range(0, len(records), self.batch_size):
+                chunk = records[i:i + self.batch_size]
+                self._write(chunk)
+                written += len(chunk)
+        except Exception:
+            # Keep only what is still unwritten so a retry does not duplicate rows
+            with open(replay_path, "w") as f:
+                f.writelines(r.to_json() + "\n" for r in records[written:])
+            raise
+        os.remove(replay_path)
+        log(f"Replayed {len(records)} spilled anomalies")
+        with self._spill_lock:
+            # Records spilled during the replay are newer than anything queued after this
+            if self._overflowing and not os.path.exists(self.spill_path):
+                self._overflowing = False
+                log("Write queue drained, queueing anomalies again")
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            batch = self._in_flight = self._take_batch()
+            try:
+                self._ensure_connection()
+                if batch:
+                    self._write(batch)
+                    log(f"Flushed {len(batch)} anomalies")
+                elif os.path.exists(self.spill_path):
+                    # Idle again after an overflow: drain what was spilled meanwhile
+                    self._replay_spill()
+            except Exception as e:
+                DB_ERRORS.inc()
+                if batch:
+                    spilled = self._spill_backlog(batch)
+                    log(f"Failed to write {len(batch)} anomalies, spilled {spilled} to {self.spill_path}: {e}")
+                    INSERT_FAILURES.inc(spilled)
+                else:
+                    log(f"Postgres write failed: {e}")
+                self._drop_connection()
+                self._stop.wait(1.0)
+            self._in_flight = []
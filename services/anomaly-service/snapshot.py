@@ -0,0 +1,139 @@
+"""
+Warm-start for the detectors.
+
+Every SNAPSHOT_INTERVAL the occupied rows of each engine (window buffer,
+fill counts, ring heads and any detector state that cannot be rebuilt from
+the window) are written to one compressed .npz file. At startup a fresh
+enough snapshot is loaded back; engines without one are seeded by replaying
+the last window of history from query_range, so detection starts on the
+first tick instead of after MIN_WINDOW_SIZE ticks.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from detectors import DetectionEngine
+from prom import PromClient, decode_matrix, unit_scale
+from util import log
+
+
+def engine_meta(engine: DetectionEngine) -> dict:
+    """Settings a snapshot must match to be reusable."""
+    return {"detector": engine.detector.name, "window_size": engine.windows.window_size}
+
+
+def save_snapshot(path: str, states: dict[str, dict], meta: dict[str, dict]):
+    manifest = {"saved_at": time.time(), "engines": {}}
+    arrays = {}
+    for name, state in states.items():
+        manifest["engines"][name] = {**meta[name], "keys": [list(map(list, k)) for k in state["keys"]]}
+        for field, value in state.items():
+            if field != "keys":
+                arrays[f"{name}/{field}"] = value
+    arrays["manifest"] = np.array(json.dumps(manifest))
+
+    # Write then rename so a crash mid-write never leaves a truncated snapshot
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+class Snapshotter:
+    def __init__(self, path: str, interval: float = 60.0, max_age: float = 900.0):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.next_save_at = time.monotonic() + interval
+
+    def _collect(self, engines: dict[str, DetectionEngine]) -> tuple[dict, dict]:
+        states = {name: engine.export() for name, engine in engines.items()}
+        meta = {name: engine_meta(engine) for name, engine in engines.items()}
+        return states, meta
+
+    def save(self, engines: dict[str, DetectionEngine]):
+        started = time.perf_counter()
+        save_snapshot(self.path, *self._collect(engines))
+        tracked = sum(len(e.windows) for e in engines.values())
+        log(f"Saved detector snapshot ({tracked} series) in {time.perf_counter() - started:.2f}s")
+
+    async def maybe_save(self, engines: dict[str, DetectionEngine]):
+        """Save if the interval has passed; state is copied on the loop, written off it."""
+        if time.monotonic() < self.next_save_at:
+            return
+        self.next_save_at = time.monotonic() + self.interval
+        states, meta = self._collect(engines)
+        try:
+            await asyncio.to_thread(save_snapshot, self.path, states, meta)
+        except Exception as e:
+            log(f"Failed to save detector snapshot: {e}")
+
+    def restore(self, engines: dict[str, DetectionEngine]) -> set[str]:
+        """Load engines from the snapshot file; returns the names that were restored."""
+        if not os.path.exists(self.path):
+            log("No detector snapshot found")
+            return set()
+        try:
+            with np.load(self.path) as data:
+                manifest = json.loads(str(data["manifest"]))
+                age = time.time() - manifest["saved_at"]
+                if age > self.max_age:
+                    log(f"Detector snapshot is {age:.0f}s old (max {self.max_age:.0f}s), ignoring it")
+                    return set()
+
+                restored = set()
+                for name, engine in engines.items():
+                    saved = manifest["engines"].get(name)
+                    if saved is None:
+                        continue
+                    if {k: saved[k] for k in ("detector", "window_size")} != engine_meta(engine):
+                        log(f"Snapshot for {name} used {saved['detector']}/{saved['window_size']}, "
+                            f"ignoring it")
+                        continue
+                    prefix = f"{name}/"
+                    state = {f[len(prefix):]: data[f] for f in data.files if f.startswith(prefix)}
+                    state["keys"] = [tuple(map(tuple, k)) for k in saved["keys"]]
+                    engine.restore(state)
+                    restored.add(name)
+                    log(f"Restored {len(state['keys'])} {name} series from snapshot ({age:.0f}s old)")
+                return restored
+        except Exception as e:
+            log(f"Failed to load detector snapshot: {e}")
+            return set()
+
+
+async def seed_from_history(engine: DetectionEngine, prom: PromClient, query: str | None,
+                            step: float, scale: float | None = None):
+    """Fill an engine's windows by replaying its last window of history."""
+    if query is None:
+        return
+    length = engine.windows.window_size
+    end = time.time()
+    start = end - (length - 1) * step
+    try:
+        data = await prom.query_range(query, start, end, step)
+    except Exception as e:
+        log(f"Could not seed {engine.metric_name} from history: {e!r}")
+        return
+
+    keys, matrix = decode_matrix([data], start, step, length,
+                                 unit_scale(query) if scale is None else scale)
+    for column in matrix.T:
+        present = np.nonzero(~np.isnan(column))[0]
+        engine.seed({keys[i]: float(column[i]) for i in present})
+    log(f"Seeded {len(keys)} {engine.metric_name} series from {length} steps of history")
+
+
+async def warm_start(snapshots: Snapshotter, engines: dict[str, DetectionEngine],
+                     queries: dict[str, str | None], prom: PromClient, step: float,
+                     scales: dict[str, float] | None = None):
+    restored = snapshots.restore(engines)
+    scales = scales or {}
+    await asyncio.gather(*(
+        seed_from_history(engine, prom, queries[name], step, scales.get(name))
+        for name, engine in engines.items() if name not in restored
+    ))
@@ -0,0 +1,2 @@
+def log(msg: str):
+    print(f"[anomaly-service] {msg}", flush=True)
@@ -0,0 +1,70 @@
+"""
+Text generation backends.
+
+A backend turns a prompt into a stream of text chunks. `gemini` calls the
+Gemini API; `stub` answers locally with deterministic text after a
+configurable latency, so the service can run and be load-tested without
+network access or an API key. Backends are built in the app lifespan, never
+at import time.
+"""
+
+import asyncio
+import hashlib
+import os
+from typing import AsyncIterator, Protocol
+
+
+class LLMBackend(Protocol):
+    # Part of the RCA cache key: output of different backends/models is not interchangeable
+    name: str
+
+    def stream(self, prompt: str) -> AsyncIterator[str]:
+        ...
+
+
+class GeminiBackend:
+    def __init__(self, model: str, api_key: str):
+        # Imported here so the stub backend does not need the package
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model)
+        self.name = f"gemini:{model}"
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        resp = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in resp:
+            yield chunk.text
+
+
+class StubBackend:
+    """Deterministic local answers: same prompt, same text, after `latency` seconds spread over the chunks."""
+
+    def __init__(self, latency: float = 1.0, chunks: int = 8):
+        self.latency = latency
+        self.chunks = max(1, chunks)
+        self.name = "stub"
+
+    def answer(self, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:12]
+        lines = [line for line in prompt.splitlines() if line.startswith("- ")]
+        evidence = lines[0][2:] if lines else "no anomalies were linked to this incident"
+        return (f"Stub RCA {digest}. Probable root cause: the most severe signal, {evidence}. "
+                f"Suggested actions: check recent deploys and dependencies of the affected service, "
+                f"then compare the anomalous window against its baseline.")
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        text = self.answer(prompt)
+        size = -(-len(text) // self.chunks)
+        for start in range(0, len(text), size):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield text[start:start + size]
+
+
+def make_backend(kind: str) -> LLMBackend:
+    """Backend selected by LLM_BACKEND, configured from the environment."""
+    if kind == "gemini":
+        return GeminiBackend(os.getenv("GEMINI_MODEL", "gemini-1.0-pro"), os.environ["GEMINI_API_KEY"])
+    if kind == "stub":
+        return StubBackend(float(os.getenv("LLM_STUB_LATENCY", "1.0")), int(os.getenv("LLM_STUB_CHUNKS", "8")))
+    raise ValueError(f"Unknown LLM_BACKEND '{kind}', expected gemini or stub")
@@ -0,0 +1,33 @@
+"""
+In-process LRU cache with a time-to-live, for generated RCA text.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,99 @@
+"""
+Prompt context for an incident.
+
+The incident's anomalies are reduced inside Postgres to one summary row per
+service and metric (count, value spread against the baseline, time span),
+so the prompt grows with the number of distinct metrics, not anomalies.
+Summaries are rendered most significant first and cut off at a token
+budget, with a note of what was left out.
+"""
+
+from datetime import datetime
+
+# Rough size of a token for English text and numbers; avoids pulling in a tokenizer
+CHARS_PER_TOKEN = 4
+
+SEVERITY_RANK = {"LOW": 1, "MEDIUM": 2, "HIGH": 3, "CRITICAL": 4}
+WORST_SEVERITY = "CASE " + " ".join(
+    f"WHEN severity = '{severity}' THEN {rank}" for severity, rank in SEVERITY_RANK.items()) + " ELSE 0 END"
+
+# Episode rows carry the peak of the whole episode in peak_value
+SUMMARY_SQL = f"""
+    SELECT service_name, metric_name,
+           count(*) AS anomalies,
+           max({WORST_SEVERITY}) AS worst_severity,
+           min(value) AS min_value,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY value) AS p50_value,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY value) AS p95_value,
+           max(greatest(value, peak_value)) AS max_value,
+           avg(baseline) AS avg_baseline,
+           max(greatest(value, peak_value) / nullif(baseline, 0)) AS max_ratio,
+           min(timestamp) AS first_seen,
+           max(coalesce(ended_at, timestamp)) AS last_seen
+    FROM anomalies
+    WHERE incident_id = %s
+    GROUP BY service_name, metric_name
+    ORDER BY max({WORST_SEVERITY}) DESC, max_ratio DESC NULLS LAST, anomalies DESC
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def fmt_time(value: datetime | None) -> str:
+    # Timestamps are stored as naive UTC
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ") if value else "unknown"
+
+
+def fmt_number(value: float | None) -> str:
+    return "n/a" if value is None else f"{value:.4g}"
+
+
+def render_summary(row: dict) -> str:
+    severity = {rank: name for name, rank in SEVERITY_RANK.items()}.get(row["worst_severity"], "UNKNOWN")
+    ratio = f" (up to {row['max_ratio']:.1f}x)" if row["max_ratio"] is not None else ""
+    return (f"- {row['service_name']} {row['metric_name']}: {row['anomalies']} anomalies, worst {severity}; "
+            f"value min {fmt_number(row['min_value'])} / p50 {fmt_number(row['p50_value'])} / "
+            f"p95 {fmt_number(row['p95_value'])} / max {fmt_number(row['max_value'])} "
+            f"vs baseline avg {fmt_number(row['avg_baseline'])}{ratio}; "
+            f"{fmt_time(row['first_seen'])} to {fmt_time(row['last_seen'])}")
+
+
+def build_context(incident: dict, summaries: list[dict], budget: int) -> str:
+    """Incident fields plus as many anomaly summaries as fit in `budget` tokens."""
+    lines = [
+        f"Title: {incident.get('title')}",
+        f"Service: {incident.get('service_name')}",
+        f"Status: {incident.get('status')}",
+        f"First seen: {fmt_time(incident.get('first_seen'))}",
+        f"Last seen: {fmt_time(incident.get('last_seen'))}",
+    ]
+    if not summaries:
+        lines.append("No anomalies are linked to this incident.")
+        return "\n".join(lines)
+
+    total = sum(row["anomalies"] for row in summaries)
+    lines.append(f"Anomalies ({total} across {len(summaries)} metrics, most severe first):")
+    used = estimate_tokens("\n".join(lines))
+    for i, row in enumerate(summaries):
+        line = render_summary(row)
+        rest = summaries[i + 1:]
+        # Keep room for the omission note unless this is the last summary
+        reserve = estimate_tokens(omission(rest)) if rest else 0
+        if used + estimate_tokens(line) + reserve > budget:
+            lines.append(omission(summaries[i:]))
+            break
+        lines.append(line)
+        used += estimate_tokens(line) + 1
+    return "\n".join(lines)
+
+
+def omission(rows: list[dict]) -> str:
+    return f"- ... {len(rows)} more metrics with {sum(r['anomalies'] for r in rows)} anomalies omitted"
+
+
+async def load_summaries(cur, incident_id: int) -> list[dict]:
+    """Per-metric anomaly summaries; `cur` must use the dict_row row factory."""
+    await cur.execute(SUMMARY_SQL, (incident_id,))
+    return await cur.fetchall()
@@ -0,0 +1,142 @@
+"""
+Background RCA jobs.
+
+Submitting incidents returns job IDs right away; a fixed pool of workers
+drains a priority queue (open incidents first, then in submission order)
+and clients poll the jobs for their status and result. Failed attempts are
+retried with exponential backoff unless the failure is permanent. Finished
+jobs are kept for polling until `history` newer ones have finished.
+"""
+
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable
+
+# Lower runs first
+PRIORITY_OPEN = 0
+PRIORITY_OTHER = 1
+
+PENDING = ("queued", "running", "retrying")
+
+
+class PermanentJobError(Exception):
+    """A failure retrying cannot fix (e.g. the incident does not exist)."""
+
+
+@dataclass
+class Job:
+    job_id: str
+    incident_id: int
+    force: bool
+    priority: int
+    status: str = "queued"
+    attempts: int = 0
+    result: dict | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    def view(self) -> dict:
+        return asdict(self)
+
+
+class JobQueue:
+    def __init__(self, run: Callable[[Job], Awaitable[dict]], workers: int = 4, max_attempts: int = 3,
+                 backoff: float = 2.0, history: int = 10000):
+        self.run = run
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.history = history
+
+        self.jobs: dict[str, Job] = {}
+        self._pending_by_incident: dict[int, str] = {}
+        self._finished: OrderedDict[str, None] = OrderedDict()
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self):
+        for i in range(self.workers):
+            self._spawn(self._work(), f"rca-worker-{i}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, coro, name: str | None = None):
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def submit(self, incident_id: int, force: bool = False, open_incident: bool = False) -> Job:
+        """Queue an RCA; an incident that already has a pending job gets that job back.
+
+        A forced submit upgrades a pending job that has not started yet; one
+        already running unforced may just serve the cached RCA, so a forced
+        job is queued behind it instead.
+        """
+        pending = self._pending_by_incident.get(incident_id)
+        if pending is not None:
+            job = self.jobs[pending]
+            if not force or job.force:
+                return job
+            if job.status != "running":
+                job.force = True
+                return job
+        job = Job(uuid.uuid4().hex, incident_id, force, PRIORITY_OPEN if open_incident else PRIORITY_OTHER)
+        self.jobs[job.job_id] = job
+        self._pending_by_incident[incident_id] = job.job_id
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job: Job):
+        self._queue.put_nowait((job.priority, next(self._seq), job.job_id))
+
+    async def _retry_later(self, job: Job, delay: float):
+        await asyncio.sleep(delay)
+        job.status = "queued"
+        self._enqueue(job)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        if self._pending_by_incident.get(job.incident_id) == job.job_id:
+            del self._pending_by_incident[job.incident_id]
+        self._finished[job.job_id] = None
+        while len(self._finished) > self.history:
+            old, _ = self._finished.popitem(last=False)
+            del self.jobs[old]
+
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self.jobs[job_id]
+            job.status = "running"
+            job.attempts += 1
+            job.started_at = job.started_at or time.time()
+            try:
+                job.result = await self.run(job)
+                job.error = None
+                self._finish(job, "done")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                if isinstance(e, PermanentJobError) or job.attempts >= self.max_attempts:
+                    self._finish(job, "failed")
+                else:
+                    job.status = "retrying"
+                    self._spawn(self._retry_later(job, self.backoff * 2 ** (job.attempts - 1)))
+
+    def stats(self) -> dict:
+        counts: dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"queued": self._queue.qsize(), "workers": self.workers, "jobs": counts}
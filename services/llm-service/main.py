@@ -1,36 +1,370 @@
-from fastapi import FastAPI
-import psycopg2
-import google.generativeai as genai
+from contextlib import asynccontextmanager, contextmanager
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+import asyncio
+import hashlib
+import json
 import os
+import time
+
+from backends import LLMBackend, make_backend
+from cache import TTLCache
+from context import build_context, load_summaries
+from jobs import Job, JobQueue, PermanentJobError
+from singleflight import SingleFlight
+from streaming import TextStream
+
+# gemini, or stub for offline runs and load tests (LLM_STUB_LATENCY, LLM_STUB_CHUNKS)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+PG_DSN = (f"host={os.getenv('PG_HOST', 'postgres')} dbname={os.getenv('PG_DB', 'observability')} "
+          f"user={os.getenv('PG_USER', 'admin')} password={os.getenv('PG_PASSWORD', 'admin')}")
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+# Seconds a request waits for a free connection before failing
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "10"))
+
+# Generated RCAs are reused while the incident data and the model are unchanged:
+# from memory for RCA_CACHE_TTL seconds, and from incidents.rca_text after that
+RCA_CACHE_SIZE = int(os.getenv("RCA_CACHE_SIZE", "1024"))
+RCA_CACHE_TTL = float(os.getenv("RCA_CACHE_TTL", "3600"))
+# At most LLM_MAX_CONCURRENCY model calls run at once; a request that cannot get a slot
+# within LLM_QUEUE_TIMEOUT seconds gets a 503 instead of queueing indefinitely
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Background RCA jobs: JOB_WORKERS at a time, each tried up to JOB_MAX_ATTEMPTS times with
+# exponential backoff starting at JOB_RETRY_BACKOFF seconds
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "2"))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "10000"))
+
+# Approximate token budget for the incident and anomaly context in the prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+# rca_text itself is left out: it is the output, not part of what the RCA is about
+INCIDENT_COLUMNS = "id, title, service_name, status, first_seen, last_seen"
+PROMPT = """Incident details:
+ID: {incident_id}
+{context}
+
+Explain probable root cause and suggested actions.
+"""
+
+# Readiness fails if Postgres does not hand out a connection within this many seconds
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))
+
+rca_cache = TTLCache(RCA_CACHE_SIZE, RCA_CACHE_TTL)
+# Concurrent requests for the same incident data share one generation, and its stream of output
+generations = SingleFlight()
+streams: dict[str, TextStream] = {}
+llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+class IncidentNotFound(PermanentJobError):
+    pass
+
+
+class LLMBusy(Exception):
+    pass
+
+
+class StageTimes:
+    """Running count, total and max per request stage, in milliseconds."""
+
+    def __init__(self):
+        self.stages: dict[str, list[float]] = {}
+
+    def add(self, timings: dict[str, float]):
+        for stage, ms in timings.items():
+            count, total, peak = self.stages.get(stage, (0, 0.0, 0.0))
+            self.stages[stage] = [count + 1, total + ms, max(peak, ms)]
+
+    def summary(self) -> dict:
+        return {stage: {"count": count, "avg_ms": round(total / count, 3), "max_ms": round(peak, 3)}
+                for stage, (count, total, peak) in self.stages.items()}
+
+
+stage_times = StageTimes()
+
+
+@contextmanager
+def timed(timings: dict[str, float], stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in timings.items())
+
+
+def rca_key(backend: LLMBackend, prompt: str) -> str:
+    """Content hash of everything the generated RCA depends on."""
+    return hashlib.sha256(f"{backend.name}\n{prompt}".encode()).hexdigest()
+
+
+async def ensure_schema(conn):
+    """Add incidents.rca_key to tables created by an older init.sql, which only runs on a fresh volume.
+
+    Runs on every new pool connection, before it is handed out; ALTER only when the column is missing.
+    """
+    cur = await conn.execute("""
+        SELECT to_regclass('incidents') IS NOT NULL, EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'incidents' AND column_name = 'rca_key')
+    """)
+    table_exists, column_exists = await cur.fetchone()
+    if table_exists and not column_exists:
+        await conn.execute("ALTER TABLE incidents ADD COLUMN IF NOT EXISTS rca_key TEXT")
+    # Connections must be handed to the pool idle
+    await conn.commit()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    backend = app.state.backend = make_backend(LLM_BACKEND)
+    # Connections are checked before being handed out and replaced if Postgres dropped them;
+    # not waiting on open lets the service start (and retry in the background) while Postgres is down
+    pool = AsyncConnectionPool(PG_DSN, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX, timeout=PG_POOL_TIMEOUT,
+                               check=AsyncConnectionPool.check_connection, configure=ensure_schema,
+                               open=False)
+    await pool.open(wait=False)
+    app.state.pool = pool
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-model = genai.GenerativeModel('gemini-1.0-pro')
+    async def run_job(job: Job) -> dict:
+        return await explain_incident(pool, backend, job.incident_id, job.force)
 
-app = FastAPI()
+    app.state.jobs = JobQueue(run_job, JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF, JOB_HISTORY)
+    app.state.jobs.start()
+    try:
+        yield
+    finally:
+        await app.state.jobs.stop()
+        await pool.close()
 
-PG = psycopg2.connect(host="postgres", dbname="observability",
-                      user="admin", password="admin")
+
+app = FastAPI(lifespan=lifespan)
+
+
+class JobRequest(BaseModel):
+    incident_ids: list[int]
+    force: bool = False
+
+
+@app.get("/healthz")
+async def liveness():
+    """The process is up and serving; says nothing about its dependencies."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readiness(request: Request, response: Response):
+    """Ready once Postgres answers through the pool."""
+    try:
+        async with request.app.state.pool.connection(timeout=READY_TIMEOUT) as conn:
+            await conn.execute("SELECT 1")
+    except Exception as e:
+        response.status_code = 503
+        return {"status": "unavailable", "detail": str(e) or type(e).__name__}
+    return {"status": "ready", "backend": request.app.state.backend.name}
+
+
+@app.get("/stats")
+async def stats(request: Request):
+    """Per-stage request timings since startup, and the job queue."""
+    return {"stages": stage_times.summary(), "rca_jobs": request.app.state.jobs.stats()}
 
 
 @app.post("/explain-incident/{incident_id}")
-def explain(incident_id: int):
-    cur = PG.cursor()
-    cur.execute("SELECT * FROM incidents WHERE id=%s", (incident_id,))
-    incident = cur.fetchone()
+async def explain(incident_id: int, request: Request, response: Response, force: bool = False):
+    """RCA for an incident; `force=true` regenerates it even if a cached one is still valid."""
+    try:
+        result = await explain_incident(request.app.state.pool, request.app.state.backend, incident_id, force)
+    except IncidentNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except LLMBusy as e:
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(1, round(LLM_QUEUE_TIMEOUT)))})
+    response.headers["Server-Timing"] = server_timing(result["timings"])
+    return result
 
-    prompt = f"""
-    Incident details:
-    ID: {incident_id}
-    Data: {incident}
 
-    Explain probable root cause and suggested actions.
+@app.get("/explain-incident/{incident_id}/stream")
+async def explain_stream(incident_id: int, request: Request, force: bool = False):
+    """Server-sent events: `chunk` events with the RCA text as it is generated, then `done` (or `error`).
+
+    The generation does not depend on the client: if it disconnects, the RCA
+    is still completed and stored.
     """
+    pool: AsyncConnectionPool = request.app.state.pool
+    backend: LLMBackend = request.app.state.backend
+    timings = {}
+    try:
+        prompt, key, rca = await lookup_incident(pool, backend, incident_id, force, timings)
+    except IncidentNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def events():
+        if rca is not None:
+            yield sse("chunk", rca)
+            yield sse("done", {"cached": True, "shared": False, "timings": timings})
+            return
+        task, stream, shared = start_generation(pool, backend, incident_id, prompt, key)
+        try:
+            async for chunk in stream.subscribe():
+                yield sse("chunk", chunk)
+            # The stream ends before the text is stored; the done event waits for that too
+            _, generation = await asyncio.shield(task)
+        except Exception as e:
+            yield sse("error", {"detail": str(e) or type(e).__name__})
+            return
+        timings.update(generation)
+        yield sse("done", {"cached": False, "shared": shared, "timings": timings})
+
+    # X-Accel-Buffering: proxies must pass events through as they come
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/rca-jobs", status_code=202)
+async def submit_jobs(body: JobRequest, request: Request):
+    """Queue RCAs for the given incidents; returns one job per incident without waiting."""
+    async with request.app.state.pool.connection() as conn:
+        cur = await conn.execute("SELECT id, lower(status) = 'open' FROM incidents WHERE id = ANY(%s)",
+                                 (body.incident_ids,))
+        open_incidents = {incident_id for incident_id, is_open in await cur.fetchall() if is_open}
+    return submit(request.app.state.jobs, [(i, i in open_incidents) for i in body.incident_ids], body.force)
+
+
+@app.post("/rca-jobs/bulk", status_code=202)
+async def submit_bulk(request: Request, force: bool = False):
+    """Queue an RCA for every incident that does not have one yet."""
+    async with request.app.state.pool.connection() as conn:
+        cur = await conn.execute(
+            "SELECT id, lower(status) = 'open' FROM incidents WHERE rca_text IS NULL ORDER BY id")
+        incidents = await cur.fetchall()
+    return submit(request.app.state.jobs, incidents, force)
+
+
+@app.get("/rca-jobs")
+async def list_jobs(request: Request, ids: str = ""):
+    """Status of the comma-separated job `ids`, or queue totals without any."""
+    jobs: JobQueue = request.app.state.jobs
+    if not ids:
+        return jobs.stats()
+    return {"jobs": [jobs.jobs[i].view() if i in jobs.jobs else {"job_id": i, "status": "unknown"}
+                     for i in ids.split(",") if i]}
+
+
+@app.get("/rca-jobs/{job_id}")
+async def get_job(job_id: str, request: Request):
+    job = request.app.state.jobs.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.view()
+
+
+def submit(jobs: JobQueue, incidents, force: bool) -> dict:
+    submitted = [jobs.submit(incident_id, force, is_open) for incident_id, is_open in incidents]
+    return {"jobs": [{"job_id": j.job_id, "incident_id": j.incident_id, "status": j.status} for j in submitted]}
+
+
+async def explain_incident(pool: AsyncConnectionPool, backend: LLMBackend, incident_id: int,
+                           force: bool = False) -> dict:
+    timings = {}
+    prompt, key, rca = await lookup_incident(pool, backend, incident_id, force, timings)
+    if rca is not None:
+        return {"rca": rca, "cached": True, "timings": timings}
+    task, _, shared = start_generation(pool, backend, incident_id, prompt, key)
+    rca, generation = await asyncio.shield(task)
+    timings.update(generation)
+    return {"rca": rca, "cached": False, "shared": shared, "timings": timings}
+
+
+async def lookup_incident(pool: AsyncConnectionPool, backend: LLMBackend, incident_id: int, force: bool,
+                          timings: dict[str, float]) -> tuple[str, str, str | None]:
+    """(prompt, RCA cache key, cached RCA or None if one has to be generated)."""
+    # No connection is held while waiting on the model
+    with timed(timings, "db_read"):
+        async with pool.connection() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            await cur.execute(f"SELECT {INCIDENT_COLUMNS}, rca_text, rca_key FROM incidents WHERE id=%s",
+                              (incident_id,))
+            incident = await cur.fetchone()
+            if incident is None:
+                raise IncidentNotFound(f"Incident {incident_id} not found")
+            summaries = await load_summaries(cur, incident_id)
+
+    with timed(timings, "prompt_build"):
+        stored_rca, stored_key = incident.pop("rca_text"), incident.pop("rca_key")
+        context = build_context(incident, summaries, PROMPT_TOKEN_BUDGET)
+        prompt = PROMPT.format(incident_id=incident_id, context=context)
+        key = rca_key(backend, prompt)
+    # Stages shared by coalesced callers are recorded once, by generate_rca
+    stage_times.add(timings)
+    if force:
+        return prompt, key, None
+    rca = rca_cache.get(key)
+    if rca is None and stored_rca and stored_key == key:
+        rca = stored_rca
+        rca_cache.put(key, rca)
+    return prompt, key, rca
+
+
+def new_generation(pool: AsyncConnectionPool, backend: LLMBackend, incident_id: int, prompt: str, key: str):
+    stream = streams[key] = TextStream()
+    return generate_rca(pool, backend, incident_id, prompt, key, stream)
+
+
+def start_generation(pool: AsyncConnectionPool, backend: LLMBackend, incident_id: int, prompt: str,
+                     key: str) -> tuple[asyncio.Task, TextStream, bool]:
+    """The generation for `key` and its output stream, started unless one is in flight."""
+    task, shared = generations.start(key, lambda: new_generation(pool, backend, incident_id, prompt, key))
+    if not shared:
+        # Runs right after the task leaves `generations`, so the two never disagree
+        task.add_done_callback(lambda _: streams.pop(key, None))
+    return task, streams[key], shared
 
-    resp = model.generate_content(prompt)
 
-    rca = resp.text
+async def generate_rca(pool: AsyncConnectionPool, backend: LLMBackend, incident_id: int, prompt: str,
+                       key: str, stream: TextStream) -> tuple[str, dict[str, float]]:
+    """Generate, publish and store an RCA; returns the text and the timings of these stages."""
+    timings = {}
+    try:
+        with timed(timings, "llm_wait"):
+            try:
+                await asyncio.wait_for(llm_slots.acquire(), LLM_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise LLMBusy("Too many RCA generations in progress")
+        try:
+            with timed(timings, "generation"):
+                async for chunk in backend.stream(prompt):
+                    stream.append(chunk)
+        finally:
+            llm_slots.release()
+    except BaseException as e:
+        stream.close(e)
+        raise
+    # Readers are done once the text is complete; storing it is not their concern
+    stream.close()
 
-    cur.execute("UPDATE incidents SET rca_text=%s WHERE id=%s", (rca, incident_id))
-    PG.commit()
+    rca = stream.text()
 
-    return {"rca": rca}
\ No newline at end of file
+    with timed(timings, "db_write"):
+        async with pool.connection() as conn:
+            await conn.execute("UPDATE incidents SET rca_text=%s, rca_key=%s WHERE id=%s",
+                               (rca, key, incident_id))
+    rca_cache.put(key, rca)
+    stage_times.add(timings)
+    return rca, timings
@@ -0,0 +1,35 @@
+"""
+Single-flight coalescing of concurrent calls with the same key.
+
+The first caller starts the work as a task of its own; callers arriving
+while it runs get that same task instead of starting another one. Callers
+should await it through asyncio.shield(), so a client disconnecting does
+not cancel the generation the others are waiting for.
+"""
+
+import asyncio
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+
+    def start(self, key: str, fn: Callable[[], Awaitable]) -> tuple[asyncio.Task, bool]:
+        """The task running `fn()` for `key`, started unless one is in flight, and whether it was."""
+        task = self._calls.get(key)
+        if task is not None:
+            return task, True
+        task = self._calls[key] = asyncio.create_task(fn())
+        task.add_done_callback(lambda t: self._forget(key, t))
+        return task, False
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Every waiter may have gone away; do not leave the exception unretrieved
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,49 @@
+"""
+Text generated piece by piece, readable by any number of subscribers.
+
+Every subscriber gets all chunks from the start, so one that joins a
+generation already under way still sees the whole text. Nothing here
+depends on the subscribers: the producer keeps appending when they go away.
+"""
+
+import asyncio
+from typing import AsyncIterator
+
+
+class TextStream:
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        # A fresh event per change, so one subscriber's wait never consumes another's wakeup
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def append(self, text: str):
+        self.chunks.append(text)
+        self._notify()
+
+    def close(self, error: BaseException | None = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Yield every chunk, from the first, until the stream closes; re-raises the producer's error."""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
@@ -0,0 +1,121 @@
+"""
+HDR-style latency histogram.
+
+Values are recorded in whole microseconds into log-linear buckets: each
+power of two is split into the same number of linear sub-buckets, so every
+recorded value is kept to `significant_digits` decimal digits of precision
+(3 digits = 0.1%) from 1us up to `highest`. Memory is bounded by the number
+of buckets whatever the number of values recorded, and histograms with the
+same settings merge exactly by adding their counts, e.g. one per interval
+or per process into a total.
+"""
+
+import math
+from typing import Dict, Iterable, Optional
+
+# Anything slower is recorded as this (one hour)
+DEFAULT_HIGHEST_US = 3_600_000_000
+
+
+class Histogram:
+    def __init__(self, significant_digits: int = 3, highest: int = DEFAULT_HIGHEST_US):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError("significant_digits must be between 1 and 5")
+        self.significant_digits = significant_digits
+        self.highest = highest
+        # Smallest power of two with enough linear sub-buckets for the precision
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count // 2
+
+        # Sparse bucket index -> count; at most index(highest) + 1 entries
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.sum = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def _index(self, value: int) -> int:
+        bucket = max(0, value.bit_length() - self.sub_bucket_bits)
+        sub_bucket = value >> bucket
+        if bucket == 0:
+            return sub_bucket
+        # Buckets after the first only use their upper half; the lower half is the previous bucket
+        return self.sub_bucket_count + (bucket - 1) * self.sub_bucket_half + sub_bucket - self.sub_bucket_half
+
+    def _highest_equivalent(self, index: int) -> int:
+        """Largest value that lands in bucket `index`."""
+        if index < self.sub_bucket_count:
+            return index
+        bucket, offset = divmod(index - self.sub_bucket_count, self.sub_bucket_half)
+        bucket += 1
+        return ((offset + self.sub_bucket_half + 1) << bucket) - 1
+
+    def record(self, value_us: int, count: int = 1):
+        value_us = min(max(int(value_us), 0), self.highest)
+        index = self._index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self.sum += value_us * count
+        self.min = value_us if self.min is None else min(self.min, value_us)
+        self.max = value_us if self.max is None else max(self.max, value_us)
+
+    def record_seconds(self, seconds: float):
+        self.record(round(seconds * 1_000_000))
+
+    def merge(self, other: "Histogram"):
+        if (other.significant_digits, other.highest) != (self.significant_digits, self.highest):
+            raise ValueError("cannot merge histograms with different settings")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @classmethod
+    def merged(cls, histograms: Iterable["Histogram"], significant_digits: int = 3,
+               highest: int = DEFAULT_HIGHEST_US) -> "Histogram":
+        total = cls(significant_digits, highest)
+        for histogram in histograms:
+            total.merge(histogram)
+        return total
+
+    def percentile(self, q: float) -> int:
+        """Value (us) at or below which `q` percent of the recorded values fall, to the histogram's precision."""
+        if not self.total:
+            return 0
+        # Rounded first so float error cannot push an exact rank to the next value
+        rank = max(1, math.ceil(round(self.total * q / 100, 9)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "significant_digits": self.significant_digits,
+            "highest": self.highest,
+            "total": self.total,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            # JSON object keys must be strings
+            "counts": {str(index): count for index, count in sorted(self.counts.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Histogram":
+        histogram = cls(data["significant_digits"], data["highest"])
+        histogram.counts = {int(index): count for index, count in data["counts"].items()}
+        histogram.total = data["total"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
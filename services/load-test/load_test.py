@@ -5,24 +5,219 @@ Generates HTTP requests to telemetry-demo-service to create:
 - Normal traffic patterns
 - Slow request patterns (for latency anomalies)
 - Error patterns (for error rate anomalies)
+
+By default each scenario is closed-loop: a pool of worker threads sends the
+next request only once a previous one has returned, so offered load drops
+as soon as the service slows down. With --rate the scenarios run open-loop
+instead: requests are scheduled at a fixed rate (constant or Poisson
+arrivals) on one asyncio event loop with a pooled HTTP client, whatever the
+response times, and latency is measured from the intended send time so
+queueing shows up in the numbers (no coordinated omission).
+
+Latencies go into fixed-size HDR-style histograms (histogram.py) per
+scenario and response status, plus one per reporting interval, so memory
+stays flat however many requests a run sends. The summary reports p50 to
+p99.9, and --json / --csv export the totals and the per-interval series
+for comparing runs.
+
+One process tops out at a few thousand requests per second. --processes
+and --remote-workers make this process a coordinator: it splits the rate
+and request counts between worker processes (local ones it starts itself,
+and `load_test.py --connect` on other hosts), which send their histograms
+back every second to be merged into one live progress view and report.
 """
 
 import requests
 import time
+import asyncio
 import concurrent.futures
-from typing import Dict, List
+import csv
+import ipaddress
+import json
+import os
+import random
+import socket
+from typing import Dict, List, Optional
 import argparse
 import sys
 
+import aiohttp
+
+from histogram import Histogram
+
+
+ARRIVALS = ("constant", "poisson")
+SCENARIOS = ("normal", "slow", "error")
+DESCRIPTIONS = {
+    "normal": "Normal Requests",
+    "slow": "Slow Requests (Latency Spikes)",
+    "error": "Error Requests",
+}
+# Pause between scenarios, in seconds
+SCENARIO_PAUSE = 2
+# How often distributed workers send their histograms to the coordinator, in seconds
+SNAPSHOT_INTERVAL = 1.0
+# Big enough for a message with several full histograms
+MAX_MESSAGE = 64 * 1024 * 1024
+PERCENTILES = (50, 90, 95, 99, 99.9)
+# Failed requests kept with their error message, per scenario
+MAX_FAILURE_SAMPLES = 5
+CSV_COLUMNS = ["kind", "scenario", "status", "start", "count", "failed", "mean_ms", "min_ms",
+               *(f"p{q:g}_ms" for q in PERCENTILES), "max_ms"]
+
+
+def ms(us: float) -> float:
+    return round(us / 1000, 3)
+
+
+def latency_summary(histogram: Histogram) -> Dict:
+    summary = {"count": histogram.total, "mean_ms": ms(histogram.mean()), "min_ms": ms(histogram.min or 0)}
+    for q in PERCENTILES:
+        summary[f"p{q:g}_ms"] = ms(histogram.percentile(q))
+    summary["max_ms"] = ms(histogram.max or 0)
+    return summary
+
+
+class WorkerFailed(Exception):
+    """A distributed worker process could not take part in the run."""
+
+
+class ScenarioStats:
+    """Latency histograms of one scenario: per response status, and per open interval.
+
+    Intervals are aligned to wall-clock multiples of `interval` and are
+    summarized into rows once closed. With auto_close a request completing
+    in a later interval closes the earlier ones; distributed workers turn
+    that off and drain() everything to the coordinator, which merges the
+    intervals of all workers before closing them.
+    """
+
+    def __init__(self, scenario: str, interval: float = 1.0, auto_close: bool = True):
+        self.scenario = scenario
+        self.interval = interval
+        self.auto_close = auto_close
+        self.intervals: List[Dict] = []
+        self._closed_until: Optional[float] = None
+        self._reset()
+
+    def _reset(self):
+        # Status code, or "error" when there was no response
+        self.by_status: Dict[str, Histogram] = {}
+        self.status_success: Dict[str, bool] = {}
+        # Open loop only: latency of successful requests from the actual send, without the schedule delay
+        self.service_time = Histogram()
+        self.failed = 0
+        self.failures: List[Dict] = []
+        # Interval start -> [latency histogram, failed count]
+        self._open: Dict[float, List] = {}
+
+    @property
+    def total(self) -> int:
+        return sum(h.total for h in self.by_status.values())
+
+    def _open_interval(self, start: float) -> List:
+        # Data for an interval that is already closed goes into the oldest open one
+        if self._closed_until is not None:
+            start = max(start, self._closed_until)
+        return self._open.setdefault(start, [Histogram(), 0])
+
+    def record(self, result: Dict, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        start = now - now % self.interval
+        if self.auto_close:
+            self.close_intervals(before=start)
+        interval = self._open_interval(start)
+
+        status = str(result["status_code"]) if result["status_code"] is not None else "error"
+        success = result.get("success", False)
+        if status not in self.by_status:
+            self.by_status[status] = Histogram()
+            self.status_success[status] = success
+        self.by_status[status].record_seconds(result["elapsed_time"])
+        interval[0].record_seconds(result["elapsed_time"])
+        if success and "service_time" in result:
+            self.service_time.record_seconds(result["service_time"])
+        if not success:
+            self.failed += 1
+            interval[1] += 1
+            if len(self.failures) < MAX_FAILURE_SAMPLES:
+                self.failures.append({"request_num": result["request_num"], "status": status,
+                                      "error": result.get("error", "Unknown error")})
+
+    def close_intervals(self, before: Optional[float] = None):
+        """Summarize the open intervals starting before `before` (all of them by default) into rows."""
+        for start in sorted(self._open):
+            if before is not None and start >= before:
+                break
+            histogram, failed = self._open.pop(start)
+            self.intervals.append({"start": round(start, 3), "failed": failed, **latency_summary(histogram)})
+            self._closed_until = start + self.interval
+
+    def drain(self) -> Dict:
+        """Everything recorded since the last drain, as JSON, and start over empty."""
+        snapshot = {
+            "statuses": {status: {"success": self.status_success[status], "histogram": h.to_dict()}
+                         for status, h in self.by_status.items()},
+            "service_time": self.service_time.to_dict(),
+            "failed": self.failed,
+            "failures": self.failures,
+            "intervals": [[start, histogram.to_dict(), failed] for start, (histogram, failed) in self._open.items()],
+        }
+        self._reset()
+        return snapshot
+
+    def merge(self, snapshot: Dict):
+        """Add a drain() of another ScenarioStats, e.g. from a worker process."""
+        for status, data in snapshot["statuses"].items():
+            if status not in self.by_status:
+                self.by_status[status] = Histogram()
+                self.status_success[status] = data["success"]
+            self.by_status[status].merge(Histogram.from_dict(data["histogram"]))
+        self.service_time.merge(Histogram.from_dict(snapshot["service_time"]))
+        self.failed += snapshot["failed"]
+        self.failures.extend(snapshot["failures"][:MAX_FAILURE_SAMPLES - len(self.failures)])
+        for start, histogram, failed in snapshot["intervals"]:
+            interval = self._open_interval(start)
+            interval[0].merge(Histogram.from_dict(histogram))
+            interval[1] += failed
+
+    def successful(self) -> Histogram:
+        return Histogram.merged(h for status, h in self.by_status.items() if self.status_success[status])
+
+    def report(self) -> Dict:
+        report = {
+            "total": self.total,
+            "successful": self.total - self.failed,
+            "failed": self.failed,
+            "latency": latency_summary(self.successful()),
+            "statuses": {
+                status: {"success": self.status_success[status], **latency_summary(h), "histogram": h.to_dict()}
+                for status, h in sorted(self.by_status.items())
+            },
+            "failures": self.failures,
+            "intervals": self.intervals,
+        }
+        if self.service_time.total:
+            report["service_time"] = latency_summary(self.service_time)
+        return report
+
 
 class LoadTest:
-    def __init__(self, base_url: str = "http://localhost:8080", max_workers: int = 10):
+    def __init__(self, base_url: str = "http://localhost:8080", max_workers: int = 10,
+                 rate: Optional[float] = None, arrival: str = "constant", connections: int = 100,
+                 timeout: float = 30.0, seed: Optional[int] = None, interval: float = 1.0):
         self.base_url = base_url
         self.max_workers = max_workers
-        self.results: Dict[str, List[Dict]] = {
-            "normal": [],
-            "slow": [],
-            "error": []
+        # Open-loop mode when set: target requests per second per scenario
+        self.rate = rate
+        self.arrival = arrival
+        self.connections = connections
+        self.timeout = timeout
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.interval = interval
+        self.stats: Dict[str, ScenarioStats] = {
+            scenario: ScenarioStats(scenario, interval) for scenario in SCENARIOS
         }
     
     def make_request(self, scenario: str, request_num: int) -> Dict:
@@ -56,6 +251,48 @@ class LoadTest:
                 "success": False,
                 "error": str(e)
             }
+
+    async def make_request_async(self, session: aiohttp.ClientSession, scenario: str,
+                                 request_num: int, intended: float) -> Dict:
+        """Make a single HTTP request that was due at `intended` (time.monotonic()).
+
+        elapsed_time counts from `intended`, so time spent waiting for the
+        scheduler or a free connection is part of the latency; service_time
+        counts from when the request actually left.
+        """
+        url = f"{self.base_url}/checkout?scenario={scenario}"
+        sent = time.monotonic()
+
+        try:
+            async with session.get(url) as response:
+                await response.read()
+            done = time.monotonic()
+            is_success = response.status == 200 if scenario != "error" else response.status == 500
+            return {
+                "scenario": scenario,
+                "request_num": request_num,
+                "status_code": response.status,
+                "elapsed_time": done - intended,
+                "service_time": done - sent,
+                "success": is_success
+            }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            done = time.monotonic()
+            return {
+                "scenario": scenario,
+                "request_num": request_num,
+                "status_code": None,
+                "elapsed_time": done - intended,
+                "service_time": done - sent,
+                "success": False,
+                "error": str(e) or type(e).__name__
+            }
+
+    def next_arrival_gap(self) -> float:
+        """Seconds between one scheduled request and the next."""
+        if self.arrival == "poisson":
+            return self.random.expovariate(self.rate)
+        return 1.0 / self.rate
     
     def run_scenario(self, scenario: str, count: int, description: str):
         """Run requests for a specific scenario."""
@@ -69,104 +306,195 @@ class LoadTest:
         failed = 0
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all requests
-            futures = {
-                executor.submit(self.make_request, scenario, i+1): i+1 
-                for i in range(count)
-            }
-            
-            # Process results as they complete
-            for future in concurrent.futures.as_completed(futures):
-                request_num = futures[future]
-                try:
-                    result = future.result()
-                    self.results[scenario].append(result)
-                    completed += 1
-                    
-                    if not result.get("success", False):
-                        failed += 1
-                    
-                    # Progress indicator
-                    if completed % 50 == 0 or completed == count:
-                        elapsed = time.time() - start_time
-                        rate = completed / elapsed if elapsed > 0 else 0
-                        print(f"  Progress: {completed}/{count} ({rate:.1f} req/s) - "
-                              f"Failed: {failed}", end='\r')
+            # Keep a bounded window of requests submitted, so memory does not grow with count
+            window = self.max_workers * 2
+            next_num = 1
+            futures = {}
+            while futures or next_num <= count:
+                while len(futures) < window and next_num <= count:
+                    futures[executor.submit(self.make_request, scenario, next_num)] = next_num
+                    next_num += 1
+
+                # Process results as they complete, refilling the window after each
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    request_num = futures.pop(future)
+                    try:
+                        result = future.result()
+                        self.stats[scenario].record(result)
+                        completed += 1
                         
-                except Exception as e:
-                    print(f"\n  Error processing request {request_num}: {e}")
-                    failed += 1
+                        if not result.get("success", False):
+                            failed += 1
+                        
+                        # Progress indicator
+                        if completed % 50 == 0 or completed == count:
+                            elapsed = time.time() - start_time
+                            rate = completed / elapsed if elapsed > 0 else 0
+                            print(f"  Progress: {completed}/{count} ({rate:.1f} req/s) - "
+                                  f"Failed: {failed}", end='\r')
+                            
+                    except Exception as e:
+                        print(f"\n  Error processing request {request_num}: {e}")
+                        failed += 1
         
         total_time = time.time() - start_time
         print(f"\n  Completed: {completed}/{count} in {total_time:.2f}s "
               f"({completed/total_time:.1f} req/s)")
         print(f"  Failed: {failed}")
+
+    async def run_scenario_async(self, scenario: str, count: int, description: str):
+        """Run requests for a specific scenario open-loop at self.rate requests per second."""
+        print(f"\n{'='*60}")
+        print(f"Running {description}")
+        print(f"Scenario: {scenario}, Count: {count}, "
+              f"Rate: {self.rate:g} req/s ({self.arrival} arrivals)")
+        print(f"{'='*60}")
+
+        connector = aiohttp.TCPConnector(limit=self.connections)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        completed = 0
+        failed = 0
+        max_lag = 0.0
+        max_in_flight = 0
+        in_flight = set()
+
+        def on_done(task: asyncio.Task):
+            nonlocal completed, failed
+            in_flight.discard(task)
+            result = task.result()
+            self.stats[scenario].record(result)
+            completed += 1
+            if not result.get("success", False):
+                failed += 1
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            start_time = time.monotonic()
+            intended = start_time
+            last_report = start_time
+            for i in range(count):
+                # Sleep until the request is due; never skip or delay the schedule to wait for responses
+                delay = intended - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                now = time.monotonic()
+                max_lag = max(max_lag, now - intended)
+
+                task = asyncio.create_task(self.make_request_async(session, scenario, i+1, intended))
+                task.add_done_callback(on_done)
+                in_flight.add(task)
+                max_in_flight = max(max_in_flight, len(in_flight))
+                intended += self.next_arrival_gap()
+
+                # Progress indicator
+                if now - last_report >= 1.0:
+                    last_report = now
+                    elapsed = now - start_time
+                    print(f"  Progress: {i+1}/{count} sent ({(i+1)/elapsed:.1f} req/s), "
+                          f"{completed} done, {len(in_flight)} in flight - Failed: {failed}", end='\r')
+
+            send_time = time.monotonic() - start_time
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            # Let the done callbacks of the last requests run
+            await asyncio.sleep(0)
+
+        total_time = time.monotonic() - start_time
+        print(f"\n  Completed: {completed}/{count} in {total_time:.2f}s "
+              f"(offered {count/send_time if send_time > 0 else 0:.1f} req/s, "
+              f"completed {completed/total_time:.1f} req/s)")
+        print(f"  Failed: {failed}")
+        print(f"  Max in flight: {max_in_flight}, max send lag: {max_lag*1000:.1f}ms")
+        if max_lag > 0.1:
+            print("  ⚠ The generator fell behind schedule; offered load was below the target rate")
     
     def print_summary(self):
         """Print summary statistics."""
         print(f"\n{'='*60}")
         print("LOAD TEST SUMMARY")
         print(f"{'='*60}")
-        
-        for scenario in ["normal", "slow", "error"]:
-            results = self.results[scenario]
-            if not results:
+
+        for scenario in SCENARIOS:
+            stats = self.stats[scenario]
+            if not stats.total:
                 continue
-            
-            successful = [r for r in results if r.get("success", False)]
-            failed = [r for r in results if not r.get("success", False)]
-            
-            if successful:
-                elapsed_times = [r["elapsed_time"] for r in successful]
-                avg_time = sum(elapsed_times) / len(elapsed_times)
-                min_time = min(elapsed_times)
-                max_time = max(elapsed_times)
-                
-                print(f"\n{scenario.upper()} Requests:")
-                print(f"  Total: {len(results)}")
-                print(f"  Successful: {len(successful)}")
-                print(f"  Failed: {len(failed)}")
-                print(f"  Avg Response Time: {avg_time*1000:.1f}ms")
-                print(f"  Min Response Time: {min_time*1000:.1f}ms")
-                print(f"  Max Response Time: {max_time*1000:.1f}ms")
-            
-            if failed:
-                print(f"  Failed Requests: {len(failed)}")
-                if len(failed) <= 5:
-                    for f in failed:
-                        error_msg = f.get("error", "Unknown error")
-                        print(f"    - Request {f['request_num']}: {error_msg}")
-    
-    def run(self, normal_count: int = 200, slow_count: int = 200, error_count: int = 500):
-        """Run the complete load test."""
+
+            print(f"\n{scenario.upper()} Requests:")
+            print(f"  Total: {stats.total}")
+            print(f"  Successful: {stats.total - stats.failed}")
+            print(f"  Failed: {stats.failed}")
+            print("  Statuses: " + ", ".join(f"{status}: {h.total}" for status, h in sorted(stats.by_status.items())))
+
+            successful = stats.successful()
+            if successful.total:
+                print("  Response Time: " + self.format_latency(successful))
+            if stats.service_time.total:
+                print("  Service Time:  " + self.format_latency(stats.service_time))
+
+            if stats.failed:
+                print(f"  Failed Requests: {stats.failed}")
+                for f in stats.failures:
+                    print(f"    - Request {f['request_num']} ({f['status']}): {f['error']}")
+
+    @staticmethod
+    def format_latency(histogram: Histogram) -> str:
+        summary = latency_summary(histogram)
+        parts = [f"p{q:g} {summary[f'p{q:g}_ms']:.1f}ms" for q in PERCENTILES]
+        return ", ".join(parts + [f"max {summary['max_ms']:.1f}ms", f"avg {summary['mean_ms']:.1f}ms"])
+
+    def report(self) -> Dict:
+        return {
+            "target": self.base_url,
+            "mode": "open" if self.rate else "closed",
+            "rate": self.rate,
+            "arrival": self.arrival if self.rate else None,
+            "workers": None if self.rate else self.max_workers,
+            "interval": self.interval,
+            "scenarios": {scenario: stats.report() for scenario, stats in self.stats.items() if stats.total},
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_csv(self, path: str):
+        """One row per scenario and status with the run totals, then one per scenario and interval."""
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+            writer.writeheader()
+            for scenario, stats in self.stats.items():
+                for status, h in sorted(stats.by_status.items()):
+                    failed = 0 if stats.status_success[status] else h.total
+                    writer.writerow({"kind": "status", "scenario": scenario, "status": status,
+                                     "failed": failed, **latency_summary(h)})
+            for scenario, stats in self.stats.items():
+                for row in stats.intervals:
+                    writer.writerow({"kind": "interval", "scenario": scenario, **row})
+
+    def run_one(self, scenario: str, count: int, description: str):
+        if self.rate:
+            asyncio.run(self.run_scenario_async(scenario, count, description))
+        else:
+            self.run_scenario(scenario, count, description)
+        self.stats[scenario].close_intervals()
+
+    def print_plan(self, plan: List, workers: int = 0):
         print(f"\n{'='*60}")
         print("LOAD TEST STARTING")
         print(f"{'='*60}")
         print(f"Target: {self.base_url}")
-        print(f"Concurrency: {self.max_workers} workers")
+        if self.rate:
+            print(f"Open loop: {self.rate:g} req/s, {self.arrival} arrivals, "
+                  f"up to {self.connections} connections" + (" per worker" if workers else ""))
+        else:
+            print(f"Concurrency: {self.max_workers} workers")
+        if workers:
+            print(f"Distributed: {workers} worker processes, {self.rate / workers:g} req/s each")
         print(f"\nTest Plan:")
-        print(f"  - {normal_count} normal requests")
-        print(f"  - {slow_count} slow requests")
-        print(f"  - {error_count} error requests")
-        print(f"  Total: {normal_count + slow_count + error_count} requests")
-        
-        total_start = time.time()
-        
-        # Run scenarios
-        if normal_count > 0:
-            self.run_scenario("normal", normal_count, "Normal Requests")
-            time.sleep(2)  # Small delay between scenarios
-        
-        if slow_count > 0:
-            self.run_scenario("slow", slow_count, "Slow Requests (Latency Spikes)")
-            time.sleep(2)
-        
-        if error_count > 0:
-            self.run_scenario("error", error_count, "Error Requests")
-        
-        total_time = time.time() - total_start
-        total_requests = normal_count + slow_count + error_count
-        
+        for scenario, count in plan:
+            print(f"  - {count} {scenario} requests")
+        print(f"  Total: {sum(count for _, count in plan)} requests")
+
+    def print_completed(self, total_requests: int, total_time: float):
         print(f"\n{'='*60}")
         print(f"LOAD TEST COMPLETED")
         print(f"{'='*60}")
@@ -184,6 +512,217 @@ class LoadTest:
         print("3. Check incident-service for created incidents")
         print("4. View dashboard: http://localhost:5173")
 
+    def run(self, normal_count: int = 200, slow_count: int = 200, error_count: int = 500):
+        """Run the complete load test."""
+        plan = make_plan(normal_count, slow_count, error_count)
+        self.print_plan(plan)
+        
+        total_start = time.time()
+        
+        # Run scenarios, with a small delay between them
+        for i, (scenario, count) in enumerate(plan):
+            if i:
+                time.sleep(SCENARIO_PAUSE)
+            self.run_one(scenario, count, DESCRIPTIONS[scenario])
+        
+        self.print_completed(sum(count for _, count in plan), time.time() - total_start)
+
+    async def run_distributed(self, normal_count: int, slow_count: int, error_count: int,
+                              processes: int, remote_workers: int = 0, listen: Optional[str] = None):
+        """Run the load test from `processes` local and `remote_workers` remote worker processes.
+
+        Each worker runs every scenario open-loop at an equal share of the
+        rate and request counts and sends what it recorded every
+        SNAPSHOT_INTERVAL; this process only merges and reports.
+        """
+        plan = make_plan(normal_count, slow_count, error_count)
+        workers = processes + remote_workers
+        self.print_plan(plan, workers)
+        for stats in self.stats.values():
+            stats.auto_close = False
+
+        connected: List[tuple] = []
+        all_connected = asyncio.Event()
+        running: Dict[str, str] = {}
+
+        async def accept(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            if len(connected) >= workers:
+                writer.close()
+                return
+            connected.append((reader, writer))
+            if len(connected) == workers:
+                all_connected.set()
+
+        # Remote workers need an address they can reach; local ones only need loopback
+        host, port = parse_address(listen or ("0.0.0.0:0" if remote_workers else "127.0.0.1:0"))
+        if remote_workers and is_loopback(host):
+            raise ValueError(f"remote workers cannot reach a coordinator listening on {host}")
+        server = await asyncio.start_server(accept, host, port, limit=MAX_MESSAGE)
+        port = server.sockets[0].getsockname()[1]
+        local_host = "127.0.0.1" if host in ("", "0.0.0.0", "::") else host
+        children = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--connect", f"{local_host}:{port}",
+                stdout=asyncio.subprocess.DEVNULL)
+            for _ in range(processes)
+        ]
+        if remote_workers:
+            print(f"\nWaiting for {remote_workers} remote workers: "
+                  f"python load_test.py --connect {socket.gethostname()}:{port}")
+        # A worker that dies before every worker has connected would leave the run waiting forever
+        connecting = asyncio.create_task(all_connected.wait())
+        exits = {asyncio.create_task(child.wait()): child for child in children}
+        try:
+            done, _ = await asyncio.wait({connecting, *exits}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            connecting.cancel()
+            for waiter in exits:
+                waiter.cancel()
+            server.close()
+        if not all_connected.is_set():
+            exited = [exits[waiter] for waiter in done if waiter in exits]
+            for child in children:
+                if child.returncode is None:
+                    child.terminate()
+                await child.wait()
+            for _, writer in connected:
+                writer.close()
+            raise WorkerFailed(f"worker process exited with code {exited[0].returncode} before connecting")
+
+        async def drive(index: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            name = f"worker-{index}"
+            send(writer, {
+                "type": "plan",
+                "url": self.base_url,
+                "scenarios": [[scenario, share(count, workers, index)] for scenario, count in plan],
+                "rate": self.rate / workers,
+                "arrival": self.arrival,
+                "connections": self.connections,
+                "timeout": self.timeout,
+                "seed": None if self.seed is None else self.seed + index,
+                "interval": self.interval,
+                # Every worker starts its first scenario at the same time
+                "start_at": start_at,
+            })
+            await writer.drain()
+            try:
+                while True:
+                    message = await receive(reader)
+                    if message is None:
+                        print(f"\n  ⚠ {name} disconnected before finishing")
+                        return
+                    if message["type"] == "snapshot":
+                        running[name] = message["scenario"]
+                        self.stats[message["scenario"]].merge(message["stats"])
+                    elif message["type"] == "done":
+                        return
+            finally:
+                running.pop(name, None)
+                writer.close()
+
+        async def progress():
+            last, last_time = 0, time.time()
+            while True:
+                await asyncio.sleep(SNAPSHOT_INTERVAL)
+                now = time.time()
+                # Wait an extra snapshot for workers that have not sent the interval yet
+                for stats in self.stats.values():
+                    stats.close_intervals(before=now - self.interval - 2 * SNAPSHOT_INTERVAL)
+                done = sum(stats.total for stats in self.stats.values())
+                scenarios = sorted(set(running.values()), key=SCENARIOS.index)
+                latest = [f"{s} p99 {self.stats[s].intervals[-1]['p99_ms']:.1f}ms"
+                          for s in scenarios if self.stats[s].intervals]
+                failed = sum(stats.failed for stats in self.stats.values())
+                print(f"  Progress: {done} done ({(done - last) / (now - last_time):.1f} req/s), "
+                      f"{len(running)}/{workers} workers on {', '.join(scenarios) or '-'}"
+                      f"{' - ' + ', '.join(latest) if latest else ''} - Failed: {failed}", end='\r')
+                last, last_time = done, now
+
+        start_at = time.time() + 1.0
+        reporter = asyncio.create_task(progress())
+        try:
+            await asyncio.gather(*(drive(i, r, w) for i, (r, w) in enumerate(connected)))
+        finally:
+            reporter.cancel()
+            for child in children:
+                if child.returncode is None:
+                    child.terminate()
+                await child.wait()
+        total_time = time.time() - start_at
+
+        for stats in self.stats.values():
+            stats.close_intervals()
+        print()
+        self.print_completed(sum(stats.total for stats in self.stats.values()), total_time)
+
+
+def make_plan(normal_count: int, slow_count: int, error_count: int) -> List:
+    """[(scenario, count)] in running order, without the scenarios that send nothing."""
+    counts = {"normal": normal_count, "slow": slow_count, "error": error_count}
+    return [(scenario, counts[scenario]) for scenario in SCENARIOS if counts[scenario] > 0]
+
+
+def share(count: int, workers: int, index: int) -> int:
+    """Worker `index`'s part of `count` requests; the parts add up to `count`."""
+    return count // workers + (1 if index < count % workers else 0)
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address: str) -> tuple:
+    host, _, port = address.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+def send(writer: asyncio.StreamWriter, message: Dict):
+    writer.write(json.dumps(message).encode() + b"\n")
+
+
+async def receive(reader: asyncio.StreamReader) -> Optional[Dict]:
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+
+async def run_worker(address: str):
+    """Connect to a coordinator, run the share of the load test it assigns and stream back the results."""
+    host, port = parse_address(address)
+    reader, writer = await asyncio.open_connection(host, port, limit=MAX_MESSAGE)
+    print(f"Connected to coordinator at {address}, waiting for the plan...")
+    plan = await receive(reader)
+    if plan is None:
+        print("Coordinator closed the connection (it already has enough workers)")
+        return
+
+    load_test = LoadTest(base_url=plan["url"], rate=plan["rate"], arrival=plan["arrival"],
+                         connections=plan["connections"], timeout=plan["timeout"], seed=plan["seed"],
+                         interval=plan["interval"])
+    for stats in load_test.stats.values():
+        stats.auto_close = False
+
+    await asyncio.sleep(max(0.0, plan["start_at"] - time.time()))
+    for i, (scenario, count) in enumerate(plan["scenarios"]):
+        if i:
+            await asyncio.sleep(SCENARIO_PAUSE)
+        if count <= 0:
+            continue
+        run = asyncio.create_task(load_test.run_scenario_async(scenario, count, DESCRIPTIONS[scenario]))
+        while True:
+            await asyncio.wait({run}, timeout=SNAPSHOT_INTERVAL)
+            send(writer, {"type": "snapshot", "scenario": scenario, "stats": load_test.stats[scenario].drain()})
+            await writer.drain()
+            if run.done():
+                run.result()
+                break
+    send(writer, {"type": "done"})
+    await writer.drain()
+    writer.close()
 
 def main():
     parser = argparse.ArgumentParser(
@@ -202,6 +741,19 @@ Examples:
   
   # Run against different host
   python load_test.py --url http://localhost:8080
+
+  # Open loop: 500 req/s with Poisson arrivals, whatever the response times
+  python load_test.py --rate 500 --arrival poisson
+
+  # Save percentiles and the per-second series for comparing runs
+  python load_test.py --json before.json --csv before.csv
+
+  # 20000 req/s from 8 local worker processes
+  python load_test.py --rate 20000 --processes 8
+
+  # ... plus 2 workers on other hosts, each started with --connect
+  python load_test.py --rate 40000 --processes 8 --remote-workers 2 --listen 0.0.0.0:7070
+  python load_test.py --connect coordinator-host:7070
         """
     )
     
@@ -239,7 +791,94 @@ Examples:
         help="Number of concurrent workers (default: 10)"
     )
     
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Open-loop mode: target requests per second per scenario (default: closed-loop workers)"
+    )
+    
+    parser.add_argument(
+        "--arrival",
+        choices=ARRIVALS,
+        default="constant",
+        help="Open-loop arrival process (default: constant)"
+    )
+    
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=100,
+        help="Open-loop mode: maximum open connections (default: 100)"
+    )
+    
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Open-loop mode: per-request timeout in seconds (default: 30)"
+    )
+    
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed for Poisson arrivals"
+    )
+    
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Length of the reporting intervals in seconds (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--json",
+        help="Write the results, including the histograms, to this JSON file"
+    )
+    
+    parser.add_argument(
+        "--csv",
+        help="Write per-status and per-interval percentiles to this CSV file"
+    )
+    
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="Open-loop mode: split the load between this many local worker processes (default: 0)"
+    )
+    
+    parser.add_argument(
+        "--remote-workers",
+        type=int,
+        default=0,
+        help="Open-loop mode: also wait for this many workers started elsewhere with --connect (default: 0)"
+    )
+    
+    parser.add_argument(
+        "--listen",
+        help="Coordinator address for workers to connect to "
+             "(default: any free port, on 127.0.0.1 or, with --remote-workers, on all interfaces)"
+    )
+    
+    parser.add_argument(
+        "--connect",
+        metavar="HOST:PORT",
+        help="Run as a worker of the coordinator at this address; it sends all other settings"
+    )
+    
     args = parser.parse_args()
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    distributed = args.processes > 0 or args.remote_workers > 0
+    if distributed and args.rate is None:
+        parser.error("--processes and --remote-workers need --rate")
+    if args.remote_workers and args.listen and is_loopback(parse_address(args.listen)[0]):
+        parser.error("--remote-workers needs a --listen address other hosts can reach, e.g. 0.0.0.0:7070")
+    
+    if args.connect:
+        asyncio.run(run_worker(args.connect))
+        return
     
     # Validate URL is reachable
     try:
@@ -257,12 +896,28 @@ Examples:
         sys.exit(1)
     
     # Run load test
-    load_test = LoadTest(base_url=args.url, max_workers=args.workers)
-    load_test.run(
-        normal_count=args.normal,
-        slow_count=args.slow,
-        error_count=args.error
-    )
+    load_test = LoadTest(base_url=args.url, max_workers=args.workers, rate=args.rate,
+                         arrival=args.arrival, connections=args.connections,
+                         timeout=args.timeout, seed=args.seed, interval=args.interval)
+    if distributed:
+        try:
+            asyncio.run(load_test.run_distributed(args.normal, args.slow, args.error, args.processes,
+                                                  args.remote_workers, args.listen))
+        except WorkerFailed as e:
+            print(f"\n✗ {e}")
+            sys.exit(1)
+    else:
+        load_test.run(
+            normal_count=args.normal,
+            slow_count=args.slow,
+            error_count=args.error
+        )
+    if args.json:
+        load_test.write_json(args.json)
+        print(f"\nResults written to {args.json}")
+    if args.csv:
+        load_test.write_csv(args.csv)
+        print(f"Results written to {args.csv}")
 
 
 if __name__ == "__main__":